@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Measures Recoder's cold start: time from spawning the process to the
+# first painted frame, and the import time of every module on the way.
+#
+# Run from the repository root after compiling resources and schemas the
+# same way dev-run.sh does:
+#
+#     python benchmarks/startup.py --runs 10
+#     python benchmarks/startup.py --json > startup.json
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def app_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.join(ROOT, "src")
+    env["GSETTINGS_SCHEMA_DIR"] = os.path.join(ROOT, "src", "resources")
+    # Don't touch the user's real settings
+    env["GSETTINGS_BACKEND"] = "memory"
+    env["RECODER_BENCHMARK_STARTUP"] = "1"
+    return env
+
+
+def measure_first_frame(timeout):
+    start = time.monotonic()
+    process = subprocess.run(
+        [sys.executable, "-m", "recoder.app"],
+        env=app_env(), capture_output=True, text=True, timeout=timeout,
+    )
+    for line in process.stdout.splitlines():
+        if line.startswith("first-frame "):
+            return float(line.split()[1]) - start
+    raise RuntimeError(f"app exited without drawing a frame:\n{process.stderr}")
+
+
+def measure_imports():
+    # The same imports main() does before the first window, without
+    # opening one
+    code = (
+        "from recoder import app; "
+        "from gi.repository import Adw; Adw.init(); "
+        "app.load_resources(); "
+        "import recoder.window"
+    )
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=app_env(), capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+
+    times = {}
+    for line in process.stderr.splitlines():
+        match = IMPORT_RE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            times[name] = {"self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000}
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Recoder startup time.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    frames = [measure_first_frame(args.timeout) for _ in range(args.runs)]
+    imports = measure_imports()
+
+    result = {
+        "runs": args.runs,
+        "first_frame_ms": {
+            "min": min(frames) * 1000,
+            "median": statistics.median(frames) * 1000,
+            "max": max(frames) * 1000,
+        },
+        "recoder_modules": {k: v for k, v in imports.items() if k.startswith("recoder")},
+        "slowest_modules": dict(sorted(
+            imports.items(), key=lambda item: item[1]["self_ms"], reverse=True
+        )[:args.top]),
+    }
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+        return
+
+    ff = result["first_frame_ms"]
+    print(f"time to first frame over {args.runs} runs: "
+          f"min {ff['min']:.0f} ms, median {ff['median']:.0f} ms, max {ff['max']:.0f} ms")
+    print()
+    print("recoder modules (cumulative ms):")
+    for name, t in sorted(result["recoder_modules"].items(), key=lambda i: -i[1]["cumulative_ms"]):
+        print(f"  {t['cumulative_ms']:8.1f}  {name}")
+    print()
+    print(f"slowest {args.top} modules (self ms):")
+    for name, t in result["slowest_modules"].items():
+        print(f"  {t['self_ms']:8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
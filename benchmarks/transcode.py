@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# End-to-end throughput benchmark. Generates synthetic clips with ffmpeg's
+# lavfi sources, runs each set through the Transcoder pipeline the same
+# way recoder-cli does and writes the numbers to a JSON file that can be
+# compared with the results of another version.
+#
+#     python benchmarks/transcode.py --output before.json
+#     python benchmarks/transcode.py --output after.json --compare before.json
+#
+# --scale shortens or lengthens every clip, e.g. --scale 0.2 for a quick run.
+#
+# Every case runs in a process of its own once its media is generated, so
+# the peak RSS of that process and its children is the pipeline's alone.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+# name, clip count, seconds per clip, width, height, rotation tag
+CASES = [
+    ("4k-portrait-rotated", 2, 10, 3840, 2160, 90),
+    ("1080p", 3, 10, 1920, 1080, 0),
+    ("720p", 3, 10, 1280, 720, 0),
+    ("short-clips", 20, 2, 1920, 1080, 0),
+    ("long-clip", 1, 120, 1920, 1080, 0),
+]
+
+
+def generate_clip(path, seconds, width, height, rotate):
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest",
+    ]
+    if rotate:
+        cmd += ["-metadata:s:v:0", f"rotate={rotate}"]
+    cmd.append(path)
+    subprocess.run(cmd, check=True)
+
+
+def generate_case(base_dir, name, count, seconds, width, height, rotate):
+    case_dir = os.path.join(base_dir, "sources", name)
+    os.makedirs(case_dir, exist_ok=True)
+    for n in range(count):
+        generate_clip(os.path.join(case_dir, f"{name}-{n:03d}.mp4"), seconds, width, height, rotate)
+    return case_dir
+
+
+def spawn_overhead(samples=5):
+    # Cost of starting and tearing down an ffmpeg process that does
+    # almost no work
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        subprocess.run([
+            "ffmpeg", "-v", "error", "-f", "lavfi", "-i", "nullsrc=s=16x16:d=0.04",
+            "-f", "null", "-"
+        ], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_case(case_dir, output_dir, jobs):
+    from gi.repository import Gio
+    from recoder import cli
+    from recoder.models import FileItem
+    from recoder.probe import probe, get_probe_cache
+    from recoder.utils import iter_video_files
+
+    paths = list(iter_video_files(Gio.File.new_for_path(case_dir)))
+
+    # Cold probes, the cache lives in this run's temporary XDG_CACHE_HOME
+    start = time.perf_counter()
+    media_seconds = sum(probe(path).duration or 0.0 for path in paths)
+    probe_seconds = time.perf_counter() - start
+
+    # Drop the entries again so the batch itself starts cold too
+    get_probe_cache().clear()
+
+    argv = paths + ["--quiet", "--no-incremental", "--no-dedupe",
+                    "-o", os.path.join(output_dir, "{{source_folder_name}}")]
+    if jobs is not None:
+        argv += ["--jobs", str(jobs)]
+    args = cli.parse_args(argv, {})
+    file_items = [FileItem(Gio.File.new_for_path(path)) for path in paths]
+
+    start = time.perf_counter()
+    exit_code = cli.BatchRunner(args, file_items).run()
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "files": len(paths),
+        "media_seconds": media_seconds,
+        "wall_seconds": wall_seconds,
+        "files_per_hour": len(paths) / wall_seconds * 3600,
+        "realtime_factor": media_seconds / wall_seconds,
+        "probe_seconds_per_file": probe_seconds / len(paths),
+        "exit_code": exit_code,
+        # ru_maxrss is in KiB on Linux; the children are ffprobe and ffmpeg
+        "peak_rss_mib": {
+            "recoder": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "ffmpeg": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        },
+    }
+
+
+def run_case_process(case_dir, output_dir, jobs, result_path):
+    cmd = [sys.executable, os.path.abspath(__file__), "--run-case", case_dir, output_dir, result_path]
+    if jobs is not None:
+        cmd += ["--jobs", str(jobs)]
+    subprocess.run(cmd, check=True)
+    with open(result_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def ffmpeg_version():
+    out = subprocess.check_output(["ffmpeg", "-version"], text=True)
+    return out.splitlines()[0]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline):
+    print(f"{'case':24} {'files/h':>10} {'baseline':>10} {'change':>8}")
+    for name, case in result["cases"].items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            continue
+        change = case["files_per_hour"] / old["files_per_hour"] - 1
+        print(f"{name:24} {case['files_per_hour']:10.0f} {old['files_per_hour']:10.0f} {change:+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Recoder transcoding throughput.")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results to compare with")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every clip length")
+    parser.add_argument("--jobs", type=int, help="parallel jobs, default from the transcoder")
+    parser.add_argument("--case", action="append", help="only run the named case, can repeat")
+    parser.add_argument("--keep", action="store_true", help="keep the generated media")
+    # Used internally to run one case in a fresh process
+    parser.add_argument("--run-case", nargs=3, metavar=("CASE_DIR", "OUTPUT_DIR", "RESULT"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        case_dir, output_dir, result_path = args.run_case
+        with open(result_path, "w", encoding="utf-8") as f:
+            json.dump(run_case(case_dir, output_dir, args.jobs), f)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="recoder-bench-")
+    # Fresh probe cache and no resumable journal left behind
+    os.environ["XDG_CACHE_HOME"] = os.path.join(work_dir, "cache")
+    os.environ["XDG_STATE_HOME"] = os.path.join(work_dir, "state")
+
+    cases = [c for c in CASES if not args.case or c[0] in args.case]
+    result = {
+        "revision": git_revision(),
+        "ffmpeg": ffmpeg_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "scale": args.scale,
+        "spawn_overhead_seconds": spawn_overhead(),
+        "cases": {},
+    }
+
+    try:
+        for name, count, seconds, width, height, rotate in cases:
+            seconds = max(1, round(seconds * args.scale))
+            print(f"generating {name}…", file=sys.stderr)
+            case_dir = generate_case(work_dir, name, count, seconds, width, height, rotate)
+            print(f"transcoding {name}…", file=sys.stderr)
+            result["cases"][name] = run_case_process(
+                case_dir, os.path.join(work_dir, "output"), args.jobs,
+                os.path.join(work_dir, f"{name}.json"),
+            )
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+        f.write("\n")
+    print(f"results written to {args.output}", file=sys.stderr)
+
+    for name, case in result["cases"].items():
+        print(f"{name:24} {case['files_per_hour']:8.0f} files/h  "
+              f"{case['realtime_factor']:6.2f}× realtime  "
+              f"probe {case['probe_seconds_per_file'] * 1000:.0f} ms/file  "
+              f"peak RSS {case['peak_rss_mib']['recoder']:.0f} MiB recoder, "
+              f"{case['peak_rss_mib']['ffmpeg']:.0f} MiB ffmpeg")
+    print(f"spawn overhead {result['spawn_overhead_seconds'] * 1000:.0f} ms/process")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
+import os
 import sys
+import time
 import gi
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 
-from gi.repository import Adw, Gio, Gtk
+from gi.repository import Adw, Gio, GLib, Gtk
 from importlib.resources import files
 from importlib.metadata import version, PackageNotFoundError
 
@@ -16,7 +18,8 @@ except PackageNotFoundError:
 
 APP_NAME = "Recoder"
 
-Adw.init()
+# Set by benchmarks/startup.py to report the first frame and exit
+STARTUP_BENCHMARK_ENV = "RECODER_BENCHMARK_STARTUP"
 
 def load_resources():
     resource_path = files("recoder").joinpath("resources.gresource")
@@ -25,11 +28,14 @@ def load_resources():
 
 
 def main():
+    from recoder import tracing
+    tracing.enable_from_env()
+
+    Adw.init()
     load_resources()
 
     # Delay imports until after resources are registered
     from recoder.window import RecoderWindow
-    from recoder.preferences import RecoderPreferences
 
     class RecoderApp(Adw.Application):
         def __init__(self):
@@ -68,8 +74,19 @@ def main():
             if not self.window:
                 self.window = RecoderWindow(self)
                 self.window.connect("close-request", self.on_window_close)
+                if os.environ.get(STARTUP_BENCHMARK_ENV):
+                    self.window.connect("map", self.on_benchmark_map)
             self.window.present()
 
+        def on_benchmark_map(self, window):
+            def on_after_paint(clock):
+                clock.disconnect(handler)
+                # CLOCK_MONOTONIC is shared with the benchmark process
+                print(f"first-frame {time.monotonic():.6f}", flush=True)
+                GLib.idle_add(self.quit)
+
+            handler = window.get_frame_clock().connect("after-paint", on_after_paint)
+
         def on_about_activate(self, action, param):
             about = Adw.AboutWindow(
                 application_name=APP_NAME,
@@ -85,6 +102,7 @@ def main():
 
         def on_preferences_activate(self, action, param):
             if not self.preferences_window:
+                from recoder.preferences import RecoderPreferences
                 self.preferences_window = RecoderPreferences()
                 self.preferences_window.set_transient_for(self.window)
                 self.preferences_window.set_modal(True)
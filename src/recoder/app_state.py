@@ -54,7 +54,6 @@ class UIStateManager:
         self._update_title(None)
         w = self.window
         w.clear_listbox()
-        w.file_rows.clear()
         w.file_items_to_process = []
         w.is_paused = False
         w.progress_bar.set_visible(False)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import signal
+import argparse
+
+import gi
+gi.require_version("GLib", "2.0")
+gi.require_version("GObject", "2.0")
+gi.require_version("Gio", "2.0")
+
+from gi.repository import GLib, Gio
+
+from recoder.models import FileItem, FileStatus
+from recoder import tracing
+from recoder.probe import probe_in_background
+from recoder.priority import parse_cpu_list
+from recoder.profiles import PROFILES
+from recoder.transcoder import (
+    Transcoder, BatchStatus, FAILURE_POLICIES, QUEUE_ORDERS, SETTINGS_SCHEMA, SETTINGS_KEYS
+)
+from recoder.utils import SUPPORTED_EXTENSIONS, format_duration, iter_video_files
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+STATUS_NAMES = {
+    FileStatus.WAITING: "waiting",
+    FileStatus.PROCESSING: "processing",
+    FileStatus.DONE: "done",
+    FileStatus.ERROR: "error",
+}
+
+
+def load_defaults():
+    # Use the GUI's preferences when the schema is installed, but never
+    # write back to them from the command line
+    source = Gio.SettingsSchemaSource.get_default()
+    if not source or not source.lookup(SETTINGS_SCHEMA, True):
+        return {}
+    settings = Gio.Settings.new(SETTINGS_SCHEMA)
+    defaults = {prop: settings.get_value(key).unpack() for key, prop in SETTINGS_KEYS}
+    defaults["recursive"] = settings.get_boolean("recursive-scan")
+    defaults["max_depth"] = settings.get_int("scan-max-depth")
+    defaults["extensions"] = settings.get_strv("video-extensions")
+    return defaults
+
+
+def int_range(minimum, maximum):
+    # argparse type for the ranges of the Transcoder properties, which
+    # would otherwise drop a value outside them with only a warning
+    def parse(text):
+        try:
+            value = int(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"not a number: {text}")
+        if not minimum <= value <= maximum:
+            raise argparse.ArgumentTypeError(f"must be between {minimum} and {maximum}: {text}")
+        return value
+    return parse
+
+
+def cpu_list(text):
+    try:
+        parse_cpu_list(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a CPU list like 0-3,6: {text}")
+    return text
+
+
+def parse_args(argv, defaults):
+    parser = argparse.ArgumentParser(
+        prog="recoder-cli",
+        description="Batch transcode videos to DNxHD without a graphical session.",
+    )
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="video files or folders")
+    parser.add_argument("-o", "--output-template", dest="output_folder_template",
+                        help="output folder template, supports {{source_folder_name}}")
+    parser.add_argument("-j", "--jobs", dest="parallel_jobs", type=int_range(0, 64),
+                        help="files to transcode at once, 0 picks one per four cores")
+    parser.add_argument("--order", dest="queue_order", choices=list(QUEUE_ORDERS),
+                        help="order in which files are transcoded")
+    parser.add_argument("--on-error", dest="failure_policy", choices=FAILURE_POLICIES,
+                        help="stop the batch, skip the file or retry it when a file fails")
+    parser.add_argument("--retries", dest="retry_count", type=int_range(1, 10),
+                        help="attempts after the first with --on-error retry")
+    parser.add_argument("-r", "--recursive", action=argparse.BooleanOptionalAction,
+                        help="also scan subfolders")
+    parser.add_argument("--max-depth", type=int, help="subfolder depth for --recursive, 0 means no limit")
+    parser.add_argument("--incremental", action=argparse.BooleanOptionalAction,
+                        help="skip files whose output is up to date")
+    parser.add_argument("--split", dest="split_long_files", action=argparse.BooleanOptionalAction,
+                        help="encode long recordings as parallel segments")
+    parser.add_argument("--dedupe", dest="deduplicate", action=argparse.BooleanOptionalAction,
+                        help="transcode identical files only once")
+    parser.add_argument("--staging-dir", dest="staging_directory", metavar="DIR",
+                        help="encode into DIR and move finished files to the output folder")
+    parser.add_argument("--extra-output", dest="extra_outputs", action="append", choices=sorted(PROFILES),
+                        help="also write this output from the same decode, can repeat")
+    parser.add_argument("--background", dest="background_priority", action=argparse.BooleanOptionalAction,
+                        help="run ffmpeg at the lowest CPU and idle I/O priority")
+    parser.add_argument("--cpus", dest="cpu_affinity", type=cpu_list, metavar="LIST",
+                        help="with --background, only use these CPUs, e.g. 0-3,6")
+    parser.add_argument("--json", action="store_true",
+                        help="print one JSON object per finished file and a summary on stdout")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress output on stderr")
+    parser.set_defaults(**{
+        "recursive": False,
+        "max_depth": 0,
+        "extensions": list(SUPPORTED_EXTENSIONS),
+        **{k: v for k, v in defaults.items() if v is not None},
+    })
+    return parser.parse_args(argv)
+
+
+class BatchRunner:
+    def __init__(self, args, file_items):
+        self.args = args
+        self.file_items = file_items
+        self.loop = GLib.MainLoop()
+        self.exit_code = EXIT_OK
+        self.finished = 0
+        self.show_progress = not args.quiet and sys.stderr.isatty()
+
+        self.transcoder = Transcoder(file_items, bind_settings=False)
+        for _, prop in SETTINGS_KEYS:
+            value = getattr(args, prop, None)
+            if value is not None:
+                self.transcoder.set_property(prop, value)
+
+        self.transcoder.connect("notify::batch-progress", self.on_progress)
+        self.transcoder.connect("notify::batch-status", self.on_status)
+        for file_item in file_items:
+            file_item.connect("notify::status", self.on_file_status)
+
+    def run(self):
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, self.on_interrupt)
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, self.on_interrupt)
+        probe_in_background(self.file_items)
+        self.transcoder.start()
+        self.loop.run()
+        return self.exit_code
+
+    def on_interrupt(self):
+        self.transcoder.stop()
+        return GLib.SOURCE_REMOVE
+
+    def on_progress(self, transcoder, pspec):
+        if self.show_progress:
+            total = len(self.file_items)
+            line = f"{transcoder.batch_progress:3d}%  {self.finished}/{total} files"
+            if transcoder.speed:
+                line += f"  {transcoder.speed:.1f}×"
+            if transcoder.eta:
+                line += f"  {format_duration(transcoder.eta)} left"
+            sys.stderr.write(f"\r{line}\033[K")
+            sys.stderr.flush()
+
+    def on_file_status(self, file_item, pspec):
+        if file_item.status not in (FileStatus.DONE, FileStatus.ERROR):
+            return
+        self.finished += 1
+        path = file_item.file.get_path()
+
+        if self.args.json:
+            result = {
+                "path": path,
+                "output": self.transcoder.get_output_path(path),
+                "status": STATUS_NAMES[file_item.status],
+            }
+            if file_item.status == FileStatus.ERROR:
+                result["error"] = file_item.error
+            print(json.dumps(result), flush=True)
+        elif not self.args.quiet:
+            if self.show_progress:
+                sys.stderr.write("\r\033[K")
+            label = "done " if file_item.status == FileStatus.DONE else "error"
+            sys.stderr.write(f"[{label}] {path}\n")
+            if file_item.status == FileStatus.ERROR and file_item.error:
+                sys.stderr.write(f"        {file_item.error.splitlines()[-1]}\n")
+
+    def on_status(self, transcoder, pspec):
+        status = transcoder.batch_status
+        finished = (BatchStatus.DONE, BatchStatus.DONE_WITH_ERRORS, BatchStatus.ERROR, BatchStatus.STOPPED)
+        if status in finished and not transcoder.is_processing:
+            self.finish(status)
+
+    def finish(self, status):
+        if self.show_progress:
+            sys.stderr.write("\n")
+
+        self.exit_code = {
+            BatchStatus.DONE: EXIT_OK,
+            BatchStatus.DONE_WITH_ERRORS: EXIT_ERROR,
+            BatchStatus.ERROR: EXIT_ERROR,
+            BatchStatus.STOPPED: EXIT_INTERRUPTED,
+        }[status]
+
+        if self.args.json:
+            counts = {}
+            for file_item in self.file_items:
+                name = STATUS_NAMES[file_item.status]
+                counts[name] = counts.get(name, 0) + 1
+            print(json.dumps({
+                "summary": status.value_nick,
+                "files": len(self.file_items),
+                **counts,
+            }), flush=True)
+
+        self.loop.quit()
+
+
+def main(argv=None):
+    tracing.enable_from_env()
+    args = parse_args(sys.argv[1:] if argv is None else argv, load_defaults())
+
+    max_depth = (args.max_depth or None) if args.recursive else 0
+    gfiles = [Gio.File.new_for_path(os.path.abspath(path)) for path in args.paths]
+    file_items = [
+        FileItem(Gio.File.new_for_path(path))
+        for path in iter_video_files(gfiles, max_depth, args.extensions)
+    ]
+
+    if not file_items:
+        sys.stderr.write("recoder-cli: no video files found\n")
+        return EXIT_USAGE
+
+    return BatchRunner(args, file_items).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import os
+import fcntl
+import shutil
+import hashlib
+import threading
+
+SAMPLE_SIZE = 1024 * 1024
+SAMPLE_COUNT = 3
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# ioctl from linux/fs.h that makes dest share the blocks of src
+FICLONE = 0x40049409
+
+
+def partial_hash(path, size):
+    # Hash a few evenly spread samples; files that differ almost always
+    # differ here, so the full hash is only needed to confirm a match
+    digest = hashlib.sha1(str(size).encode("ascii"))
+    with open(path, "rb") as f:
+        for n in range(SAMPLE_COUNT):
+            f.seek(max(0, (size - SAMPLE_SIZE) * n // max(1, SAMPLE_COUNT - 1)))
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_output(src, dest):
+    # Hardlink if possible, reflink across directories on the same CoW
+    # filesystem, plain copy as a last resort
+    if os.path.abspath(src) == os.path.abspath(dest):
+        return
+    tmp_dest = f"{dest}.tmp"
+    try:
+        os.remove(tmp_dest)
+    except OSError:
+        pass
+    try:
+        os.link(src, tmp_dest)
+    except OSError:
+        with open(src, "rb") as fsrc, open(tmp_dest, "wb") as fdest:
+            try:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+            except OSError:
+                shutil.copyfileobj(fsrc, fdest, CHUNK_SIZE)
+    os.replace(tmp_dest, dest)
+
+
+class _Source:
+    def __init__(self, path, size, sample):
+        self.path = path
+        self.size = size
+        self.sample = sample
+        self.full = None
+        self.finished = False
+        self.success = False
+        self.output_path = None
+        self.primary = None
+        self.waiters = []
+
+    def get_full_hash(self):
+        if self.full is None:
+            self.full = full_hash(self.path)
+        return self.full
+
+
+# Remembers every source the batch has started on, so later copies of the
+# same content can reuse the first copy's output instead of encoding again
+class DuplicateIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources = {}
+        self._by_size = {}
+
+    def register(self, path):
+        # Returns the source this one duplicates, or None if it is new
+        with self._lock:
+            known = self._sources.get(path)
+        if known is not None:
+            # Asked again for a job that was put back in the queue
+            return known.primary
+
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            same_size = list(self._by_size.get(size, []))
+        if not same_size:
+            sample = None
+        else:
+            try:
+                sample = partial_hash(path, size)
+            except OSError:
+                return None
+
+        source = _Source(path, size, sample)
+        primary = None
+        for candidate in same_size:
+            try:
+                if candidate.sample is None:
+                    candidate.sample = partial_hash(candidate.path, size)
+                if candidate.sample == sample and candidate.get_full_hash() == source.get_full_hash():
+                    primary = candidate
+                    break
+            except OSError:
+                continue
+
+        source.primary = primary
+        with self._lock:
+            self._sources[path] = source
+            if primary is None:
+                self._by_size.setdefault(size, []).append(source)
+        return primary
+
+    def when_finished(self, source, callback):
+        # Calls callback once source has an output or failed, right away if
+        # that already happened
+        with self._lock:
+            if not source.finished:
+                source.waiters.append(callback)
+                return
+        callback()
+
+    def finish(self, path, success, output_path):
+        with self._lock:
+            source = self._sources.get(path)
+            if source is None:
+                return
+            source.success = success
+            source.output_path = output_path
+            source.finished = True
+            waiters, source.waiters = source.waiters, []
+        for callback in waiters:
+            callback()
@@ -0,0 +1,124 @@
+import os
+import threading
+
+# Kept free on every output filesystem on top of the estimated sizes
+SAFETY_MARGIN = 256 * 1024 * 1024
+# mov headers and index, a little on top of the raw stream bitrates
+CONTAINER_OVERHEAD = 1.02
+
+DEFAULT_SAMPLE_RATE = 48000
+DEFAULT_CHANNELS = 2
+
+
+def _parse_bitrate(value):
+    units = {"k": 1_000, "M": 1_000_000, "G": 1_000_000_000}
+    try:
+        if value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except (ValueError, IndexError):
+        return None
+
+
+def _option(cmd, name):
+    try:
+        return cmd[cmd.index(name) + 1]
+    except (ValueError, IndexError):
+        return None
+
+
+def estimate_output_size(cmd, info):
+    # Bytes the ffmpeg command will write for this source, taken from the
+    # bitrate in the command and the probed duration
+    if not info.duration:
+        return 0
+
+    if _option(cmd, "-vcodec") == "copy":
+        video_bitrate = info.video_bitrate or 0
+    else:
+        video_bitrate = _parse_bitrate(_option(cmd, "-b:v") or "") or info.video_bitrate or 0
+
+    # PCM is the target and the largest audio anyone sends us, so it is a
+    # fair upper bound for copied audio too
+    sample_rate = info.audio_sample_rate or DEFAULT_SAMPLE_RATE
+    channels = info.audio_channels or DEFAULT_CHANNELS
+    audio_bitrate = sample_rate * channels * 16 if info.audio_codec else 0
+
+    return int(info.duration * (video_bitrate + audio_bitrate) / 8 * CONTAINER_OVERHEAD)
+
+
+def existing_dir(path):
+    while path and not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path or "."
+
+
+def free_bytes(path):
+    st = os.statvfs(existing_dir(path))
+    return st.f_bavail * st.f_frsize
+
+
+class _Reservation:
+    def __init__(self, devices, size):
+        self.devices = devices
+        self.size = size
+        self.written = 0
+
+    @property
+    def outstanding(self):
+        return max(0, self.size - self.written)
+
+
+# Keeps track of how much the running jobs are still going to write to
+# each filesystem, so a job only starts when its output fits next to them
+class SpaceReservations:
+    def __init__(self, margin=SAFETY_MARGIN):
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._reservations = {}
+        self._next_token = 0
+
+    def try_reserve(self, folders, size):
+        # Returns a token, or None if the output doesn't fit right now
+        devices = {}
+        for folder in folders:
+            folder = existing_dir(folder)
+            try:
+                devices.setdefault(os.stat(folder).st_dev, folder)
+            except OSError:
+                continue
+
+        with self._lock:
+            for device, folder in devices.items():
+                try:
+                    free = free_bytes(folder)
+                except OSError:
+                    continue
+                pending = sum(
+                    r.outstanding for r in self._reservations.values() if device in r.devices
+                )
+                if free - pending - self.margin < size:
+                    return None
+            token = self._next_token
+            self._next_token += 1
+            self._reservations[token] = _Reservation(set(devices), size)
+            return token
+
+    def update(self, token, written):
+        # Bytes already on disk are part of the free space statvfs reports
+        with self._lock:
+            reservation = self._reservations.get(token)
+            if reservation and written:
+                reservation.written = max(reservation.written, written)
+
+    def release(self, token):
+        with self._lock:
+            self._reservations.pop(token, None)
+
+    @property
+    def active(self):
+        with self._lock:
+            return len(self._reservations)
@@ -2,13 +2,20 @@ import gi
 from gi.repository import Gtk, Gdk, Gio, GLib
 from functools import partial
 from recoder.app_state import AppState
+from recoder import tracing
+
+# While files are loaded or a batch runs, drops and pastes are added to
+# the list and the running queue; otherwise they start a new list
+ADDING_STATES = {
+    AppState.TRANSCODING,
+    AppState.PAUSED,
+    AppState.FILES_LOADED,
+}
 
 class DropHandler:
     def __init__(self, w, app_state_manager):
         self.w = w
         self.app_state_manager = app_state_manager
-        self._accepting = self._compute_accept()
-        self.app_state_manager.connect("notify::state", self.on_state_changed)
 
         # --- Drag & Drop ---
         self.drop_target = Gtk.DropTarget.new(Gio.File, Gdk.DragAction.COPY)
@@ -27,26 +34,11 @@ class DropHandler:
         )
         self.w.add_controller(self.shortcut_ctrl_v)
 
-    def _compute_accept(self):
-        return self.app_state_manager.state not in {
-            AppState.TRANSCODING,
-            AppState.PAUSED,
-            AppState.FILES_LOADED,
-        }
-
-    def on_state_changed(self, *_):
-        accepting = self._compute_accept()
-        if accepting != self._accepting:
-            self._accepting = accepting
-            if accepting:
-                self.w.overlay.add_controller(self.drop_target)
-            else:
-                self.w.overlay.remove_controller(self.drop_target)
+    def _is_adding(self):
+        return self.app_state_manager.state in ADDING_STATES
 
     # ---------------- Drag & Drop ----------------
     def on_drop_enter(self, *_):
-        if not self._accepting:
-            return False
         self.w.drop_hint.add_css_class("drop-highlight")
         return True
 
@@ -55,16 +47,11 @@ class DropHandler:
         return True
 
     def on_drop(self, _, value, __, ___):
-        if not self._accepting:
-            return False
         self._start_processing(value)
         return True
 
     # ---------------- Clipboard Paste ----------------
     def on_paste_clipboard(self, *_):
-        if not self._accepting:
-            return True
-
         clipboard = self.w.get_clipboard()
         clipboard.read_text_async(None, self._on_clipboard_text_ready)
         return True
@@ -92,10 +79,14 @@ class DropHandler:
 
     # ---------------- Shared ----------------
     def _start_processing(self, value):
+        if self._is_adding():
+            tracing.idle_add(partial(self.w.add_drop_value, value))
+            return
+
         if self.w.drop_hint.get_parent():
             self.w.overlay.remove_overlay(self.w.drop_hint)
         self.w.drop_hint.set_visible(False)
         self.w.progress_bar.set_visible(True)
         self.w.progress_bar.set_fraction(0.0)
-        GLib.idle_add(partial(self.w.process_drop_value, value))
+        tracing.idle_add(partial(self.w.process_drop_value, value))
 
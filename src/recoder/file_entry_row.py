@@ -1,8 +1,9 @@
 import gi
 gi.require_version("Gtk", "4.0")
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 
 from recoder.models import FileStatus
+from recoder.utils import format_duration
 
 ICONS = {
     FileStatus.WAITING: "network-idle-symbolic",
@@ -18,30 +19,95 @@ LABELS = {
 }
 
 @Gtk.Template(resource_path="/net/jeena/recoder/file_entry_row.ui")
-class FileEntryRow(Gtk.ListBoxRow):
+class FileEntryRow(Gtk.Box):
     __gtype_name__ = "FileEntryRow"
 
     icon = Gtk.Template.Child()
     label = Gtk.Template.Child()
+    info_label = Gtk.Template.Child()
     progress_label = Gtk.Template.Child()
     level_bar = Gtk.Template.Child()
+    front_button = Gtk.Template.Child()
+    error_label = Gtk.Template.Child()
 
-    def __init__(self, item):
+    # Rows are recycled by the list view, so they get bound to whichever
+    # FileItem is scrolled into view instead of owning one for good
+    def __init__(self, on_move_to_front=None):
         super().__init__()
+        self.item = None
+        self._handlers = []
+        self.on_move_to_front = on_move_to_front
+        self.front_button.connect("clicked", self.on_front_clicked)
+
+    def bind(self, item):
         self.item = item
-        self.item.connect("notify::status", self.update_display)
-        self.item.connect("notify::progress", self.update_display)
+        self._handlers = [
+            item.connect("notify::status", self.update_display),
+            item.connect("notify::progress", self.update_display),
+            item.connect("notify::eta", self.update_display),
+            item.connect("notify::codec", self.update_info),
+            item.connect("notify::pinned", self.update_display),
+            item.connect("notify::error", self.update_display),
+        ]
         self.update_display()
+        self.update_info()
+
+    def unbind(self):
+        for handler in self._handlers:
+            self.item.disconnect(handler)
+        self._handlers = []
+        self.item = None
+
+    def on_front_clicked(self, button):
+        if self.item and self.on_move_to_front:
+            self.on_move_to_front(self.item)
+
+    def update_info(self, *args):
+        parts = []
+        if self.item.width and self.item.height:
+            parts.append(f"{self.item.width}×{self.item.height}")
+        if self.item.codec:
+            parts.append(self.item.codec)
+        if self.item.duration:
+            parts.append(format_duration(self.item.duration))
+        self.info_label.set_text(" · ".join(parts))
+        self.info_label.set_visible(bool(parts))
 
     def update_display(self, *args):
         basename = self.item.file.get_basename()
         self.label.set_text(basename)
         icon_name = ICONS.get(self.item.status, "object-select-symbolic")
         self.icon.set_from_icon_name(icon_name)
+        self.front_button.set_visible(
+            self.on_move_to_front is not None
+            and self.item.status == FileStatus.WAITING
+            and not self.item.pinned
+        )
+
+        # The last line of ffmpeg's errors, all of them in the tooltip
+        error = self.item.error
+        self.error_label.set_text(error.splitlines()[-1] if error else "")
+        self.error_label.set_visible(bool(error))
 
         if self.item.status == FileStatus.PROCESSING:
-            self.progress_label.set_text(f"{self.item.progress}%")
+            parts = []
+            if self.item.speed:
+                parts.append(f"{self.item.speed:.1f}×")
+            if self.item.fps:
+                parts.append(f"{self.item.fps:.0f} fps")
+            if self.item.eta:
+                parts.append(f"{format_duration(self.item.eta)} left")
+            parts.append(f"{self.item.progress}%")
+            self.progress_label.set_text(" · ".join(parts))
             self.level_bar.set_value(self.item.progress)
+
+            written = []
+            if self.item.bitrate:
+                written.append(f"{self.item.bitrate / 1_000_000:.0f} Mbit/s")
+            if self.item.bytes_written:
+                written.append(f"{GLib.format_size(self.item.bytes_written)} written")
+            self.set_tooltip_text(error or " · ".join(written) or None)
         else:
+            self.set_tooltip_text(error or None)
             self.progress_label.set_text(LABELS.get(self.item.status, ""))
             self.level_bar.set_value(100 if self.item.status == FileStatus.DONE else 0)
@@ -0,0 +1,122 @@
+import os
+import json
+import threading
+
+from gi.repository import GLib
+from recoder.models import FileStatus
+from recoder.segments import remove_segment_dir
+
+JOURNAL_NAME = "batch-journal.jsonl"
+
+
+def default_journal_path():
+    return os.path.join(GLib.get_user_state_dir(), "recoder", JOURNAL_NAME)
+
+
+class JournalState:
+    def __init__(self):
+        self.files = []
+        self.done = set()
+        self.failed = set()
+        self.in_flight = {}
+
+    @property
+    def pending(self):
+        return [path for path in self.files if path not in self.done]
+
+
+# Write-ahead log of a running batch. Every event is appended and fsynced
+# before the work it describes starts, so after a crash the journal tells
+# which files finished and which outputs are only half written.
+class BatchJournal:
+    def __init__(self, path=None):
+        self.path = path or default_journal_path()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _append(self, event):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def begin(self, file_items):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            self._file = open(self.path, "w", encoding="utf-8")
+        # Files finished before a resume go into the same event, so this
+        # is a single fsync however long the batch is
+        self._append({
+            "event": "batch",
+            "files": [item.file.get_path() for item in file_items],
+            "done": [item.file.get_path() for item in file_items if item.status == FileStatus.DONE],
+        })
+
+    def add(self, file_items):
+        self._append({"event": "add", "files": [item.file.get_path() for item in file_items]})
+
+    def started(self, path, output_path):
+        self._append({"event": "start", "path": path, "output": output_path})
+
+    def finished(self, path, success):
+        self._append({"event": "done" if success else "error", "path": path})
+
+    def detach(self):
+        # Keep the journal on disk so the batch can be resumed next launch
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def close(self):
+        self.detach()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or default_journal_path()
+        state = JournalState()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # The last line may be cut off by a crash
+                continue
+            kind = event.get("event")
+            if kind in ("batch", "add"):
+                state.files += [p for p in event["files"] if p not in state.files]
+                state.done.update(event.get("done", []))
+            elif kind == "start":
+                state.in_flight[event["path"]] = event["output"]
+            elif kind == "done":
+                state.done.add(event["path"])
+                state.failed.discard(event["path"])
+                state.in_flight.pop(event["path"], None)
+            elif kind == "error":
+                state.failed.add(event["path"])
+                state.in_flight.pop(event["path"], None)
+
+        if not state.files or not state.pending:
+            return None
+        return state
+
+    @staticmethod
+    def discard_partial_outputs(state):
+        for output_path in state.in_flight.values():
+            try:
+                os.remove(output_path)
+            except OSError:
+                pass
+            remove_segment_dir(output_path)
+        state.in_flight.clear()
@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import threading
+from dataclasses import asdict
+
+MANIFEST_NAME = ".recoder-manifest.json"
+MANIFEST_VERSION = 1
+
+
+def probe_fingerprint(info):
+    data = json.dumps(asdict(info), sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+# Remembers which sources were encoded into an output folder and with what
+# settings, so a re-run can skip files whose output is still valid.
+# Changes are kept in memory until save(), once the batch is over.
+class OutputManifest:
+    def __init__(self, folder):
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == MANIFEST_VERSION:
+            self._entries = data.get("entries", {})
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"version": MANIFEST_VERSION, "entries": self._entries}
+            self._dirty = False
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass
+
+    def is_up_to_date(self, source_path, output_path, fingerprint, params):
+        with self._lock:
+            entry = self._entries.get(os.path.basename(output_path))
+        if not entry:
+            return False
+        return (
+            entry["source"] == os.path.abspath(source_path)
+            and entry["source_stamp"] == _file_stamp(source_path)
+            and entry["fingerprint"] == fingerprint
+            and entry["params"] == params
+            and entry["output_stamp"] == _file_stamp(output_path)
+        )
+
+    def record(self, source_path, output_path, fingerprint, params):
+        entry = {
+            "source": os.path.abspath(source_path),
+            "source_stamp": _file_stamp(source_path),
+            "fingerprint": fingerprint,
+            "params": params,
+            "output_stamp": _file_stamp(output_path),
+        }
+        with self._lock:
+            self._entries[os.path.basename(output_path)] = entry
+            self._dirty = True
+
+    def forget(self, output_path):
+        with self._lock:
+            if self._entries.pop(os.path.basename(output_path), None) is not None:
+                self._dirty = True
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import threading
+
+from gi.repository import GLib
+
+METRICS_NAME = "metrics.jsonl"
+# The log is rotated to metrics.jsonl.1 once it gets this big
+MAX_LOG_BYTES = 16 * 1024 * 1024
+# Weight of the newest sample in the smoothed speeds the ETAs are based on
+SMOOTHING = 0.2
+
+
+def default_metrics_path():
+    return os.path.join(GLib.get_user_state_dir(), "recoder", METRICS_NAME)
+
+
+def smooth(previous, sample, weight=SMOOTHING):
+    if not previous:
+        return sample
+    return previous + weight * (sample - previous)
+
+
+# Timings and throughput of one file from entering the queue until its
+# output is in place
+class JobMetrics:
+    def __init__(self, path, queued_at):
+        self.path = path
+        self.queued_at = queued_at
+        self.started_at = None
+        self.probe_seconds = 0.0
+        self.encode_started_at = None
+        self.encode_seconds = 0.0
+        self.finalize_seconds = 0.0
+        self.media_seconds = None
+        self.fps = 0.0
+        self.speed = 0.0
+        self.smoothed_speed = 0.0
+        self.bitrate = 0.0
+        self.bytes_written = 0
+        self.out_time = 0.0
+        self.attempt = 1
+        self.encoding = False
+        # "up-to-date" or "linked" when nothing had to be encoded
+        self.outcome = None
+
+    def update(self, fields):
+        if fields.get("fps") is not None:
+            self.fps = fields["fps"]
+        if fields.get("speed") is not None:
+            self.speed = fields["speed"]
+            self.smoothed_speed = smooth(self.smoothed_speed, fields["speed"])
+        if fields.get("bitrate") is not None:
+            self.bitrate = fields["bitrate"]
+        if fields.get("total_size") is not None:
+            self.bytes_written = fields["total_size"]
+
+    @property
+    def eta(self):
+        # Seconds until the encode is done, 0 while it can't be told
+        if not self.media_seconds or not self.smoothed_speed:
+            return 0.0
+        return max(0.0, self.media_seconds - self.out_time) / self.smoothed_speed
+
+    def record(self, status, output_path, error=None):
+        now = time.monotonic()
+        started_at = self.started_at or now
+        record = {
+            "time": time.time(),
+            "path": self.path,
+            "output": output_path,
+            "status": status,
+            "attempt": self.attempt,
+            "media_seconds": self.media_seconds,
+            "queue_seconds": round(started_at - self.queued_at, 3),
+            "probe_seconds": round(self.probe_seconds, 3),
+            "encode_seconds": round(self.encode_seconds, 3),
+            "finalize_seconds": round(self.finalize_seconds, 3),
+            "total_seconds": round(now - started_at, 3),
+            "fps": self.fps,
+            "speed": self.speed,
+            "bitrate": self.bitrate,
+            "bytes_written": self.bytes_written,
+        }
+        if error:
+            record["error"] = error
+        return record
+
+
+# Appends one JSON line per finished job; kept across batches so throughput
+# can be compared over time
+class MetricsLog:
+    def __init__(self, path=None):
+        self.path = path or default_metrics_path()
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > MAX_LOG_BYTES:
+                    os.replace(self.path, f"{self.path}.1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                # Metrics are nice to have, never worth failing a file over
+                pass
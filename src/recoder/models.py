@@ -13,7 +13,26 @@ class FileItem(GObject.GObject):
     file = GObject.Property(type=Gio.File)
     progress = GObject.Property(type=int, minimum=0, maximum=100, default=0)
     status = GObject.Property(type=FileStatus, default=FileStatus.WAITING)
+    speed = GObject.Property(type=float, default=0.0)
+    # Live encode metrics, bitrate in bits/s and eta in seconds, 0 if unknown
+    fps = GObject.Property(type=float, default=0.0)
+    bitrate = GObject.Property(type=float, default=0.0)
+    bytes_written = GObject.Property(type=GObject.TYPE_UINT64, default=0)
+    eta = GObject.Property(type=float, default=0.0)
+
+    # Filled in by the background prober, 0/"" until then
+    duration = GObject.Property(type=float, default=0.0)
+    width = GObject.Property(type=int, default=0)
+    height = GObject.Property(type=int, default=0)
+    codec = GObject.Property(type=str, default="")
+
+    # Why the last attempt failed, "" if it didn't
+    error = GObject.Property(type=str, default="")
+
+    # Moved to the front of the queue by the user
+    pinned = GObject.Property(type=bool, default=False)
 
     def __init__(self, file: Gio.File):
         super().__init__()
         self.file = file
+        self.probe_future = None
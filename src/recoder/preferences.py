@@ -4,11 +4,31 @@ gi.require_version("Adw", "1")
 from gi.repository import Gtk, Gio, Adw
 import re
 
+from recoder.priority import parse_cpu_list
+from recoder.transcoder import FAILURE_POLICIES, QUEUE_ORDERS
+
+# Values of the queue-order key, in the order of the combo row
+QUEUE_ORDER_VALUES = list(QUEUE_ORDERS)
+
 @Gtk.Template(resource_path="/net/jeena/recoder/preferences.ui")
 class RecoderPreferences(Adw.PreferencesWindow):
     __gtype_name__ = "RecoderPreferences"
 
     output_folder_entry = Gtk.Template.Child()
+    recursive_scan_row = Gtk.Template.Child()
+    scan_max_depth_row = Gtk.Template.Child()
+    parallel_jobs_row = Gtk.Template.Child()
+    queue_order_row = Gtk.Template.Child()
+    failure_policy_row = Gtk.Template.Child()
+    retry_count_row = Gtk.Template.Child()
+    incremental_row = Gtk.Template.Child()
+    deduplicate_row = Gtk.Template.Child()
+    split_long_files_row = Gtk.Template.Child()
+    staging_directory_row = Gtk.Template.Child()
+    background_priority_row = Gtk.Template.Child()
+    cpu_affinity_row = Gtk.Template.Child()
+    proxy_output_row = Gtk.Template.Child()
+    wav_output_row = Gtk.Template.Child()
 
     def __init__(self):
         super().__init__()
@@ -22,6 +42,51 @@ class RecoderPreferences(Adw.PreferencesWindow):
         self.output_folder_entry.connect("changed", self.on_output_folder_changed)
         self.settings.connect("changed::output-folder-template", self.on_setting_changed)
 
+        self.settings.bind("recursive-scan", self.recursive_scan_row, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.settings.bind("scan-max-depth", self.scan_max_depth_row, "value", Gio.SettingsBindFlags.DEFAULT)
+        self.settings.bind("recursive-scan", self.scan_max_depth_row, "sensitive", Gio.SettingsBindFlags.GET)
+        self.settings.connect("changed::recursive-scan", self.on_pref_changed)
+        self.settings.connect("changed::scan-max-depth", self.on_pref_changed)
+
+        self.settings.bind("parallel-jobs", self.parallel_jobs_row, "value", Gio.SettingsBindFlags.DEFAULT)
+        self.settings.connect("changed::parallel-jobs", self.on_pref_changed)
+
+        order = self.settings.get_string("queue-order")
+        self.queue_order_row.set_selected(QUEUE_ORDER_VALUES.index(order) if order in QUEUE_ORDER_VALUES else 0)
+        self.queue_order_row.connect("notify::selected", self.on_queue_order_selected)
+        self.settings.connect("changed::queue-order", self.on_pref_changed)
+
+        policy = self.settings.get_string("failure-policy")
+        self.failure_policy_row.set_selected(FAILURE_POLICIES.index(policy) if policy in FAILURE_POLICIES else 0)
+        self.failure_policy_row.connect("notify::selected", self.on_failure_policy_selected)
+        self.settings.connect("changed::failure-policy", self.on_failure_policy_changed)
+        self.retry_count_row.set_sensitive(policy == "retry")
+
+        self.settings.bind("retry-count", self.retry_count_row, "value", Gio.SettingsBindFlags.DEFAULT)
+        self.settings.connect("changed::retry-count", self.on_pref_changed)
+
+        self.settings.bind("incremental", self.incremental_row, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.settings.connect("changed::incremental", self.on_pref_changed)
+
+        self.settings.bind("deduplicate", self.deduplicate_row, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.settings.connect("changed::deduplicate", self.on_pref_changed)
+
+        self.settings.bind("split-long-files", self.split_long_files_row, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.settings.connect("changed::split-long-files", self.on_pref_changed)
+
+        self.settings.bind("staging-directory", self.staging_directory_row, "text", Gio.SettingsBindFlags.DEFAULT)
+        self.settings.connect("changed::staging-directory", self.on_pref_changed)
+
+        self.settings.bind("background-priority", self.background_priority_row, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.cpu_affinity_row.set_text(self.settings.get_string("cpu-affinity"))
+        self.cpu_affinity_row.connect("changed", self.on_cpu_affinity_changed)
+
+        extra_outputs = self.settings.get_strv("extra-outputs")
+        for name, row in (("proxy-540p", self.proxy_output_row), ("audio-wav", self.wav_output_row)):
+            row.set_active(name in extra_outputs)
+            row.connect("notify::active", self.on_extra_output_toggled, name)
+        self.settings.connect("changed::extra-outputs", self.on_pref_changed)
+
     def validate_template(self, text):
         allowed_pattern = r'^[\w\s\-./~${}]+$'
         if not re.match(allowed_pattern, text):
@@ -50,6 +115,35 @@ class RecoderPreferences(Adw.PreferencesWindow):
         else:
             entry.add_css_class("error")
 
+    def on_cpu_affinity_changed(self, entry):
+        text = entry.get_text()
+        try:
+            parse_cpu_list(text)
+        except ValueError:
+            entry.add_css_class("error")
+            return
+        self.settings.set_string("cpu-affinity", text)
+        entry.remove_css_class("error")
+
+    def on_queue_order_selected(self, row, pspec):
+        self.settings.set_string("queue-order", QUEUE_ORDER_VALUES[row.get_selected()])
+
+    def on_failure_policy_selected(self, row, pspec):
+        self.settings.set_string("failure-policy", FAILURE_POLICIES[row.get_selected()])
+
+    def on_failure_policy_changed(self, settings, key):
+        self.retry_count_row.set_sensitive(settings.get_string(key) == "retry")
+        self.prefs_changed = True
+
+    def on_extra_output_toggled(self, row, pspec, name):
+        outputs = [o for o in self.settings.get_strv("extra-outputs") if o != name]
+        if row.get_active():
+            outputs.append(name)
+        self.settings.set_strv("extra-outputs", outputs)
+
+    def on_pref_changed(self, settings, key):
+        self.prefs_changed = True
+
     def on_setting_changed(self, settings, key):
         if key == "output-folder-template":
             new_val = settings.get_string(key)
@@ -0,0 +1,86 @@
+import os
+import ctypes
+import platform
+
+# Nice level of ffmpeg in background mode, the lowest there is
+BACKGROUND_NICE = 19
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# Class "none" follows the CPU nice level, "idle" only gets the disk when
+# nobody else wants it
+IOPRIO_CLASS_NONE = 0
+IOPRIO_CLASS_IDLE = 3
+
+# ioprio_set has no wrapper in glibc or the os module
+IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "riscv64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+}
+
+_libc = None
+
+
+def parse_cpu_list(text):
+    # "0-3,6" as in taskset -c, returns a set of CPU numbers; empty for all
+    cpus = set()
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        first, last = int(first), int(last or first)
+        if first < 0 or last < first:
+            raise ValueError(f"invalid CPU range: {part}")
+        cpus.update(range(first, last + 1))
+    return cpus
+
+
+def _ioprio_set(tid, ioprio_class):
+    global _libc
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None:
+        return
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.syscall(number, IOPRIO_WHO_PROCESS, tid, ioprio_class << IOPRIO_CLASS_SHIFT)
+
+
+def _threads(pid):
+    # Nice level, I/O priority and affinity belong to single threads on
+    # Linux, and ffmpeg has started its threads by the time this is switched
+    try:
+        return [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        return [pid]
+
+
+def apply(pid, background, cpus=None):
+    # Puts a running process and all its threads into background mode with
+    # an optional CPU set, or back to the priority Recoder itself runs at.
+    # Raising the priority again can be refused by RLIMIT_NICE; such jobs
+    # stay in the background until they finish, new ones start normally.
+    if background:
+        nice = BACKGROUND_NICE
+        ioprio_class = IOPRIO_CLASS_IDLE
+        available = os.sched_getaffinity(0)
+        cpus = (cpus or available) & available or available
+    else:
+        nice = os.getpriority(os.PRIO_PROCESS, 0)
+        ioprio_class = IOPRIO_CLASS_NONE
+        cpus = os.sched_getaffinity(0)
+
+    for tid in _threads(pid):
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, nice)
+        except OSError:
+            pass
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass
+        _ioprio_set(tid, ioprio_class)
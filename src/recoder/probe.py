@@ -0,0 +1,244 @@
+import os
+import json
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from gi.repository import GLib
+
+from recoder import tracing
+
+CACHE_VERSION = 2
+MAX_CACHE_ENTRIES = 10000
+PROBE_WORKERS = 4
+
+
+@dataclass
+class ProbeInfo:
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    rotate: int = 0
+    video_codec: Optional[str] = None
+    pix_fmt: Optional[str] = None
+    video_bitrate: Optional[int] = None
+    audio_codec: Optional[str] = None
+    audio_channels: Optional[int] = None
+    audio_layout: Optional[str] = None
+    audio_sample_rate: Optional[int] = None
+
+
+def _parse_rotation(stream):
+    rotate = stream.get("tags", {}).get("rotate")
+    if rotate is None:
+        for side_data in stream.get("side_data_list", []):
+            if "rotation" in side_data:
+                rotate = side_data["rotation"]
+                break
+    try:
+        return abs(int(float(rotate))) % 360
+    except (TypeError, ValueError):
+        return 0
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_ffprobe_json(data):
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+
+    return ProbeInfo(
+        duration=_to_float(data.get("format", {}).get("duration")) or _to_float(video.get("duration")),
+        width=_to_int(video.get("width")),
+        height=_to_int(video.get("height")),
+        rotate=_parse_rotation(video),
+        video_codec=video.get("codec_name"),
+        pix_fmt=video.get("pix_fmt"),
+        video_bitrate=_to_int(video.get("bit_rate")),
+        audio_codec=audio.get("codec_name"),
+        audio_channels=_to_int(audio.get("channels")),
+        audio_layout=audio.get("channel_layout"),
+        audio_sample_rate=_to_int(audio.get("sample_rate")),
+    )
+
+
+def run_ffprobe(path):
+    with tracing.span("ffprobe", "probe", path=path):
+        out = subprocess.check_output([
+            "ffprobe", "-v", "error", "-print_format", "json",
+            "-show_format", "-show_streams", path
+        ], text=True)
+    return parse_ffprobe_json(json.loads(out))
+
+
+# LRU cache of ffprobe results on disk, keyed by path, size and mtime
+class ProbeCache:
+    def __init__(self, cache_path, max_entries=MAX_CACHE_ENTRIES):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != CACHE_VERSION:
+            return
+        for path, entry in data.get("entries", []):
+            self._entries[path] = entry
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"version": CACHE_VERSION, "entries": list(self._entries.items())}
+            self._dirty = False
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def get(self, path, st):
+        with self._lock:
+            entry = self._entries.get(path)
+            if not entry or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+                return None
+            self._entries.move_to_end(path)
+            self._dirty = True
+            return ProbeInfo(**entry["info"])
+
+    def put(self, path, st, info):
+        with self._lock:
+            self._entries[path] = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "info": asdict(info),
+            }
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_probe_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            cache_path = os.path.join(GLib.get_user_cache_dir(), "recoder", "probe-cache.json")
+            _cache = ProbeCache(cache_path)
+        return _cache
+
+
+def probe(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ProbeInfo()
+
+    cache = get_probe_cache()
+    info = cache.get(path, st)
+    if info is not None:
+        return info
+
+    try:
+        info = run_ffprobe(path)
+    except Exception:
+        return ProbeInfo()
+
+    cache.put(path, st, info)
+    return info
+
+
+class ProbePool:
+    def __init__(self, max_workers=PROBE_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="probe")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def submit(self, file_item):
+        with self._lock:
+            self._pending += 1
+        file_item.probe_future = self._executor.submit(self._probe_item, file_item)
+
+    def _probe_item(self, file_item):
+        try:
+            info = probe(file_item.file.get_path())
+            tracing.idle_add(self._apply, file_item, info)
+            return info
+        finally:
+            with self._lock:
+                self._pending -= 1
+                idle = self._pending == 0
+            if idle:
+                get_probe_cache().flush()
+
+    def _apply(self, file_item, info):
+        file_item.duration = info.duration or 0.0
+        file_item.width = info.width or 0
+        file_item.height = info.height or 0
+        file_item.codec = info.video_codec or ""
+        return False
+
+
+_pool = None
+
+
+def probe_in_background(file_items):
+    global _pool
+    with _cache_lock:
+        if _pool is None:
+            _pool = ProbePool()
+    for file_item in file_items:
+        _pool.submit(file_item)
+
+
+def probe_item(file_item):
+    # Reuse the background probe if one is running or done, otherwise probe
+    # now instead of waiting for the probes queued ahead of this file, e.g.
+    # one that was moved to the front or added late to a long list
+    future = file_item.probe_future
+    if future is None:
+        return probe(file_item.file.get_path())
+    if future.cancel():
+        # Later calls (retries) find it in the probe cache
+        file_item.probe_future = None
+        return _pool._probe_item(file_item)
+    return future.result()
@@ -0,0 +1,49 @@
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+
+# An additional file made from the same decode as the DNxHD master
+@dataclass(frozen=True)
+class OutputProfile:
+    name: str
+    suffix: str
+    extension: str
+    # Height of the picture, None for audio only
+    height: Optional[int]
+    args: Tuple[str, ...]
+    # Rough total bitrate, only used to estimate the needed disk space
+    bitrate: int
+
+
+PROFILES = {
+    "proxy-540p": OutputProfile(
+        name="proxy-540p",
+        suffix="_proxy",
+        extension="mp4",
+        height=540,
+        args=(
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", "-f", "mp4",
+        ),
+        bitrate=4_000_000,
+    ),
+    "audio-wav": OutputProfile(
+        name="audio-wav",
+        suffix="",
+        extension="wav",
+        height=None,
+        args=("-c:a", "pcm_s16le", "-f", "wav"),
+        bitrate=1_536_000,
+    ),
+}
+
+
+def get_profiles(names):
+    return [PROFILES[name] for name in names if name in PROFILES]
+
+
+def extra_output_path(output_path, profile):
+    # Next to the master, so every output follows the folder template
+    root, _ = os.path.splitext(output_path)
+    return f"{root}{profile.suffix}.{profile.extension}"
@@ -0,0 +1,125 @@
+import threading
+from collections import deque
+
+from gi.repository import GLib
+
+from recoder import tracing
+
+# Property updates from worker threads are applied at most once per frame
+FRAME_INTERVAL_MS = 33
+
+# Only errors go to stderr, so its last lines explain a failure
+PROGRESS_ARGS = ["-progress", "pipe:1", "-nostats", "-hide_banner", "-loglevel", "error"]
+STDERR_TAIL_LINES = 10
+
+
+def with_progress_args(cmd):
+    return cmd[:1] + PROGRESS_ARGS + cmd[1:]
+
+
+def _number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Reads ffmpeg's -progress key=value stream and yields one dict per block
+def read_progress(stream):
+    block = {}
+    for line in stream:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value
+        if key == "progress":
+            yield parse_block(block)
+            block = {}
+
+
+def _bitrate(value):
+    # "1234.5kbits/s" to bits per second
+    if not value or not value.endswith("kbits/s"):
+        return None
+    kbits = _number(value[:-len("kbits/s")])
+    return kbits * 1000 if kbits is not None else None
+
+
+def parse_block(block):
+    out_time_us = _number(block.get("out_time_us") or block.get("out_time_ms"), int)
+    # Some builds report a huge negative time before the first packet
+    if out_time_us is not None and out_time_us < 0:
+        out_time_us = None
+    speed = block.get("speed", "").rstrip("x")
+    return {
+        "frame": _number(block.get("frame"), int),
+        "fps": _number(block.get("fps")),
+        "out_time": out_time_us / 1_000_000 if out_time_us is not None else None,
+        "total_size": _number(block.get("total_size"), int),
+        "bitrate": _bitrate(block.get("bitrate")),
+        "speed": _number(speed),
+        "end": block.get("progress") == "end",
+    }
+
+
+def combine_progress(running, total_size):
+    # One file's progress from the fields of its segments encoding at the
+    # same time: rates add up, the bitrate is the same stream's, and the
+    # size includes the segments that are already finished
+    def values(name):
+        return [fields[name] for fields in running if fields.get(name) is not None]
+
+    bitrates = values("bitrate")
+    return {
+        "fps": sum(values("fps")) if values("fps") else None,
+        "speed": sum(values("speed")) if values("speed") else None,
+        "bitrate": sum(bitrates) / len(bitrates) if bitrates else None,
+        "total_size": total_size,
+    }
+
+
+# Drains a process's stderr on a thread, so it can't fill the pipe, and
+# keeps the last few lines
+class StderrTail:
+    def __init__(self, stream, lines=STDERR_TAIL_LINES):
+        self._lines = deque(maxlen=lines)
+        self._thread = threading.Thread(target=self._read, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def _read(self, stream):
+        for line in stream:
+            line = line.strip()
+            if line:
+                self._lines.append(line)
+
+    def text(self):
+        self._thread.join(timeout=1)
+        return "\n".join(self._lines)
+
+
+# Collects GObject property updates from any thread and applies only the
+# latest value of each on the main loop, in one dispatch per frame interval
+class PropertyCoalescer:
+    def __init__(self, interval_ms=FRAME_INTERVAL_MS):
+        self.interval_ms = interval_ms
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._scheduled = False
+
+    def set(self, obj, name, value):
+        with self._lock:
+            self._pending[(obj, name)] = value
+            if self._scheduled:
+                return
+            self._scheduled = True
+        GLib.timeout_add(self.interval_ms, self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._scheduled = False
+        with tracing.span("PropertyCoalescer.flush", "mainloop", updates=len(pending)):
+            for (obj, name), value in pending.items():
+                obj.set_property(name, value)
+        return False
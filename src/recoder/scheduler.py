@@ -0,0 +1,302 @@
+import os
+import threading
+from functools import lru_cache
+from collections import Counter, deque
+
+from recoder.diskspace import existing_dir
+
+# Jobs at once on a spinning disk or card reader; more only make it seek
+SLOW_DEVICE_JOBS = 1
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Splits a fixed number of CPU threads between the ffmpeg jobs running at
+# the same time. Every job gets its share when it starts; cores freed by a
+# finished job go to the jobs started after it.
+class ThreadBudget:
+    def __init__(self, total=None):
+        self.total = total or available_cores()
+        self._lock = threading.Lock()
+        self._allocated = {}
+        self._next_token = 0
+
+    def acquire(self, expected_jobs):
+        with self._lock:
+            slots_left = max(1, expected_jobs - len(self._allocated))
+            free = self.total - sum(self._allocated.values())
+            threads = max(1, free // slots_left)
+            token = self._next_token
+            self._next_token += 1
+            self._allocated[token] = threads
+            return token, threads
+
+    def release(self, token):
+        with self._lock:
+            self._allocated.pop(token, None)
+
+    @property
+    def active_jobs(self):
+        with self._lock:
+            return len(self._allocated)
+
+
+def apply_thread_args(cmd, threads):
+    # Decoder threads are an input option, filter and encoder threads are
+    # output options, so they go around the first input and before the
+    # output path at the end
+    cmd = list(cmd)
+    first_input = cmd.index("-i")
+    cmd[first_input:first_input] = ["-threads", str(threads)]
+    cmd[-1:-1] = ["-filter_threads", str(threads), "-threads", str(threads)]
+    return cmd
+
+
+def device_of(path):
+    try:
+        return os.stat(existing_dir(path)).st_dev
+    except OSError:
+        return None
+
+
+def _read_sysfs(path):
+    try:
+        with open(path, encoding="ascii") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=None)
+def device_job_limit(device):
+    # How many jobs may read or write the block device at once, None for
+    # no limit of its own (SSDs, network and virtual filesystems)
+    sys_path = os.path.realpath(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+    if not os.path.isdir(sys_path):
+        return None
+    if not os.path.isdir(os.path.join(sys_path, "queue")):
+        # A partition, the queue settings belong to the whole disk
+        sys_path = os.path.dirname(sys_path)
+    if _read_sysfs(os.path.join(sys_path, "queue", "rotational")) == "1":
+        return SLOW_DEVICE_JOBS
+    if _read_sysfs(os.path.join(sys_path, "removable")) == "1":
+        return SLOW_DEVICE_JOBS
+    if os.path.basename(sys_path).startswith("mmcblk"):
+        return SLOW_DEVICE_JOBS
+    return None
+
+
+# Jobs waiting for a worker. While the queue is held open (e.g. a folder
+# scan is still adding files) or jobs are on hold, idle workers block
+# instead of exiting.
+#
+# With job_devices, a function returning the devices a job reads and
+# writes, get() keeps every device within device_job_limit() and prefers
+# jobs on the devices that are least busy, so a slow card reader doesn't
+# hold up files on other disks. The devices are looked up by the workers
+# in get(), never by the thread calling put().
+#
+# Waiting jobs are taken in the order of set_order()'s key, with jobs
+# passed to prioritize() ahead of everything else. Jobs on hold, parked,
+# due to come back with put_later() or announced with add_pending() keep
+# the workers waiting. Once the workers are gone, put() refuses new jobs.
+class JobQueue:
+    def __init__(self, jobs=(), job_devices=None):
+        self._cond = threading.Condition()
+        self._jobs = deque(jobs)
+        self._held = []
+        self._parked = set()
+        # Jobs whose devices hold() or park() already released, so the
+        # worker's done() doesn't release them again once it runs elsewhere
+        self._set_aside = set()
+        self._pending = 0
+        self._open = False
+        self._cancelled = False
+        self._drained = False
+        self._job_devices = job_devices
+        self._order = None
+        self._priority = {}
+        self._next_priority = 0
+        self._devices = {}
+        self._running = {}
+        self._busy = Counter()
+
+    def put(self, jobs):
+        with self._cond:
+            if self._drained:
+                return False
+            self._jobs.extend(jobs)
+            self._cond.notify_all()
+            return True
+
+    def set_order(self, key):
+        # key(job) sorts the waiting jobs, None takes them as they came
+        with self._cond:
+            self._order = key
+            self._cond.notify_all()
+
+    def prioritize(self, job):
+        # Put a waiting job ahead of all others, including ones that were
+        # prioritized before
+        with self._cond:
+            self._next_priority += 1
+            self._priority[job] = -self._next_priority
+            self._cond.notify_all()
+
+    def hold(self, job):
+        # Put a job aside until release_held(), e.g. while it doesn't fit
+        # on the disk; jobs behind it go first
+        with self._cond:
+            self._devices[job] = self._release_devices(job) or ()
+            self._set_aside.add(job)
+            self._held.append(job)
+
+    def park(self, job):
+        # Put a job aside until unpark(job), e.g. a copy of a file that is
+        # still being transcoded
+        with self._cond:
+            self._devices[job] = self._release_devices(job) or ()
+            self._set_aside.add(job)
+            self._parked.add(job)
+
+    def unpark(self, job):
+        # Back to the front of the queue
+        with self._cond:
+            if job in self._parked:
+                self._parked.discard(job)
+                self._jobs.appendleft(job)
+                self._cond.notify_all()
+
+    def put_later(self, job, delay):
+        # Back into the queue after delay seconds; idle workers wait for it
+        with self._cond:
+            self._pending += 1
+
+        def put():
+            devices = self._job_devices(job) if self._job_devices else ()
+            with self._cond:
+                self._pending -= 1
+                self._devices[job] = devices
+                self._jobs.append(job)
+                self._cond.notify_all()
+
+        timer = threading.Timer(delay, put)
+        timer.daemon = True
+        timer.start()
+
+    def add_pending(self):
+        # Work that isn't a job but may still lead to more, e.g. an output
+        # being moved into place; idle workers wait until remove_pending()
+        with self._cond:
+            self._pending += 1
+
+    def remove_pending(self):
+        with self._cond:
+            self._pending -= 1
+            self._cond.notify_all()
+
+    def release_held(self):
+        with self._cond:
+            self._jobs.extendleft(reversed(self._held))
+            self._held = []
+            self._cond.notify_all()
+
+    def set_open(self, is_open):
+        with self._cond:
+            self._open = is_open
+            self._cond.notify_all()
+
+    def cancel(self):
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def get(self):
+        with self._cond:
+            while True:
+                if self._cancelled:
+                    return None
+                if self._resolve_devices():
+                    # New jobs may have come in meanwhile, look again
+                    continue
+                if self._jobs:
+                    job = self._pick()
+                    if job is not None:
+                        break
+                elif not (self._open or self._held or self._parked or self._running or self._pending):
+                    self._drained = True
+                    return None
+                self._cond.wait()
+
+            self._jobs.remove(job)
+            self._priority.pop(job, None)
+            devices = self._devices.pop(job, ())
+            self._running[job] = devices
+            self._busy.update(devices)
+            return job
+
+    def done(self, job):
+        # The job no longer uses its devices; safe to call more than once
+        with self._cond:
+            if job in self._set_aside:
+                self._set_aside.discard(job)
+                return
+            self._release_devices(job)
+
+    def _resolve_devices(self):
+        # Called with the lock held; returns whether it had to look any up
+        if not self._job_devices:
+            return False
+        unresolved = [job for job in self._jobs if job not in self._devices]
+        if not unresolved:
+            return False
+        # Outside the lock, stat() on a slow disk can take a while
+        self._cond.release()
+        try:
+            devices = {job: self._job_devices(job) for job in unresolved}
+        finally:
+            self._cond.acquire()
+        waiting = set(self._jobs)
+        for job, job_devices in devices.items():
+            if job in waiting:
+                self._devices.setdefault(job, job_devices)
+        return True
+
+    def _release_devices(self, job):
+        devices = self._running.pop(job, None)
+        if devices is not None:
+            self._busy.subtract(devices)
+            self._cond.notify_all()
+        return devices
+
+    def _ordered(self):
+        jobs = list(self._jobs)
+        if self._order:
+            jobs.sort(key=self._order)
+        if self._priority:
+            jobs.sort(key=lambda job: self._priority.get(job, 0))
+        return jobs
+
+    def _pick(self):
+        # The first job whose devices all have room, among those the least
+        # busy devices
+        best, best_load = None, None
+        for job in self._ordered():
+            devices = self._devices.get(job, ())
+            if any(self._busy[d] >= (device_job_limit(d) or float("inf")) for d in devices):
+                continue
+            load = sum(self._busy[d] for d in devices)
+            if best is None or load < best_load:
+                best, best_load = job, load
+                if load == 0:
+                    break
+        return best
+
+    def __len__(self):
+        with self._cond:
+            return len(self._jobs)
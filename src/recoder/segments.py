@@ -0,0 +1,89 @@
+import shutil
+import subprocess
+
+# Files shorter than this are always encoded in one piece
+SPLIT_MIN_DURATION = 600.0
+SEGMENT_MIN_DURATION = 60.0
+SEGMENT_DIR_SUFFIX = ".segments"
+# Packets read from each cut target on; ffprobe seeks to the keyframe
+# before the target, this reaches the next one for common GOP lengths
+KEYFRAME_SCAN_PACKETS = 600
+
+
+def cut_targets(duration, count):
+    # Evenly spaced points to cut near, none if it isn't worth splitting
+    count = min(count, int(duration // SEGMENT_MIN_DURATION))
+    if count < 2:
+        return []
+    return [duration * n / count for n in range(1, count)]
+
+
+def probe_keyframes(path, targets):
+    # Only the packets around each target are read, and reading packet
+    # flags doesn't decode anything, so this is fast even for long
+    # recordings
+    intervals = ",".join(f"{target:.3f}%+#{KEYFRAME_SCAN_PACKETS}" for target in targets)
+    try:
+        out = subprocess.check_output([
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-read_intervals", intervals,
+            "-show_entries", "packet=pts_time,flags",
+            "-of", "csv=p=0", path
+        ], text=True)
+    except Exception:
+        return []
+
+    keyframes = []
+    for line in out.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" not in flags:
+            continue
+        try:
+            keyframes.append(float(pts_time))
+        except ValueError:
+            continue
+    return sorted(keyframes)
+
+
+def plan_segments(keyframes, duration, count):
+    # Cut at the keyframe closest to each evenly spaced target so every
+    # segment starts cleanly and can be concatenated without re-encoding
+    targets = cut_targets(duration, count)
+    if not targets or not keyframes:
+        return []
+
+    cuts = []
+    for target in targets:
+        cut = min(keyframes, key=lambda k: abs(k - target))
+        previous = cuts[-1] if cuts else 0.0
+        if cut - previous >= SEGMENT_MIN_DURATION and duration - cut >= SEGMENT_MIN_DURATION:
+            cuts.append(cut)
+
+    if not cuts:
+        return []
+
+    bounds = [0.0] + cuts + [duration]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def segment_dir(output_path):
+    return f"{output_path}{SEGMENT_DIR_SUFFIX}"
+
+
+def remove_segment_dir(output_path):
+    shutil.rmtree(segment_dir(output_path), ignore_errors=True)
+
+
+def write_concat_list(segment_paths, list_path):
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def build_concat_command(list_path, source_path, out_path):
+    return [
+        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+        "-i", source_path, "-map", "0", "-map_metadata", "1",
+        "-c", "copy", "-f", "mov", out_path
+    ]
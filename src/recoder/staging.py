@@ -0,0 +1,95 @@
+import os
+import queue
+import shutil
+import itertools
+import threading
+
+from recoder import tracing
+
+PARTIAL_SUFFIX = ".partial"
+
+_counter = itertools.count()
+
+
+def work_path_for(output_path, staging_dir=None):
+    # Where ffmpeg writes before the result is moved to output_path. Either
+    # a unique name in the staging directory or a hidden file next to the
+    # final output, so an unfinished file never has the final name.
+    name = os.path.basename(output_path)
+    if staging_dir:
+        return os.path.join(staging_dir, f"{os.getpid()}-{next(_counter)}-{name}")
+    return os.path.join(os.path.dirname(output_path), f".{name}{PARTIAL_SUFFIX}")
+
+
+def move_into_place(src, dest):
+    try:
+        os.replace(src, dest)
+        return
+    except OSError:
+        pass
+
+    # Different filesystem: copy next to the destination, then rename so
+    # the final path only ever holds a complete file
+    tmp_dest = os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}{PARTIAL_SUFFIX}")
+    try:
+        shutil.copyfile(src, tmp_dest)
+        os.replace(tmp_dest, dest)
+    except OSError:
+        try:
+            os.remove(tmp_dest)
+        except OSError:
+            pass
+        raise
+    os.remove(src)
+
+
+def remove_work_files(moves):
+    # What is left of a job's outputs after a failed encode or move; the
+    # ones already moved are gone from their work paths
+    for src, _ in moves:
+        try:
+            os.remove(src)
+        except OSError:
+            pass
+
+
+# Moves finished outputs from the staging directory to their destination
+# on a background thread, so the copy overlaps with the next encode. The
+# files of one job are moved together and reported once.
+class OutputMover:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, moves, on_done):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._queue.put((moves, on_done))
+
+    def drain(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            try:
+                moves, on_done = self._queue.get(timeout=1)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            try:
+                with tracing.span("OutputMover.move", "io", files=len(moves)):
+                    for src, dest in moves:
+                        move_into_place(src, dest)
+                success, reason = True, None
+            except OSError as e:
+                success, reason = False, f"Couldn't move the output into place: {e}"
+            try:
+                on_done(success, reason)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,153 @@
+# Opt-in tracing of where the time goes between a drop and a finished file.
+# Enable it with the environment or the hidden trace-file preference:
+#
+#     RECODER_TRACE=/tmp/recoder-trace.json recoder
+#     gsettings set net.jeena.recoder.preferences trace-file /tmp/recoder-trace.json
+#
+# The file is written after every batch and on exit; open it in
+# https://ui.perfetto.dev or chrome://tracing.
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+from contextlib import nullcontext
+
+from gi.repository import GLib
+
+# Path of the trace file, or "1" for trace-<pid>.json in the state dir
+TRACE_ENV = "RECODER_TRACE"
+
+# What span() hands out while tracing is off, so a disabled span is one
+# global lookup and a no-op with block
+_NO_SPAN = nullcontext()
+_tracer = None
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+# Collects complete spans ("X" events) in memory and writes them in the
+# Chrome trace-event format that Perfetto and chrome://tracing read
+class Tracer:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = {}
+
+    def add(self, name, start_us, duration_us, category, args=None):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_us,
+            "dur": duration_us,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def save(self):
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        names = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        ]
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": names + events, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp_path, self.path)
+
+
+class _Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, self.start, _now_us() - self.start, self.category, self.args)
+        return False
+
+
+def enable(path=None):
+    global _tracer
+    if _tracer is not None:
+        return
+    if not path or path == "1":
+        path = os.path.join(GLib.get_user_state_dir(), "recoder", f"trace-{os.getpid()}.json")
+    _tracer = Tracer(os.path.expanduser(path))
+    atexit.register(save)
+
+
+def enable_from_env():
+    path = os.environ.get(TRACE_ENV)
+    if path:
+        enable(path)
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def span(name, category="recoder", **args):
+    if _tracer is None:
+        return _NO_SPAN
+    return _Span(_tracer, name, category, args)
+
+
+def traced(name, category="recoder"):
+    # Decorator for a function that should show up as one span
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _Span(_tracer, name, category, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def save():
+    if _tracer is not None:
+        try:
+            _tracer.save()
+        except OSError:
+            pass
+
+
+def idle_add(callback, *args):
+    # GLib.idle_add that also records how long the callback waited for the
+    # main loop and how long it ran
+    if _tracer is None:
+        return GLib.idle_add(callback, *args)
+
+    name = getattr(callback, "__qualname__", None) or getattr(getattr(callback, "func", None), "__qualname__", "idle")
+    queued = _now_us()
+
+    def run(*call_args):
+        start = _now_us()
+        _tracer.add(f"wait {name}", queued, start - queued, "mainloop")
+        try:
+            return callback(*call_args)
+        finally:
+            _tracer.add(name, start, _now_us() - start, "idle")
+
+    return GLib.idle_add(run, *args)
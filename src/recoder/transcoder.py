@@ -1,11 +1,24 @@
 import os
+import time
 import threading
 import subprocess
-import re
 import signal
+from concurrent.futures import ThreadPoolExecutor
 
-from gi.repository import GLib, GObject, Gio
+from gi.repository import GObject, Gio
 from recoder.models import FileStatus, FileItem
+from recoder.probe import probe_item, get_probe_cache
+from recoder.manifest import OutputManifest, probe_fingerprint
+from recoder import segments
+from recoder.dedupe import DuplicateIndex, link_output
+from recoder import tracing
+from recoder import priority
+from recoder.metrics import JobMetrics, MetricsLog, smooth
+from recoder.diskspace import SpaceReservations, estimate_output_size
+from recoder.profiles import get_profiles, extra_output_path
+from recoder.staging import OutputMover, work_path_for, move_into_place, remove_work_files
+from recoder.scheduler import JobQueue, ThreadBudget, apply_thread_args, available_cores, device_of
+from recoder.progress import PropertyCoalescer, StderrTail, combine_progress, read_progress, with_progress_args
 
 
 class BatchStatus(GObject.GEnum):
@@ -17,32 +30,162 @@ class BatchStatus(GObject.GEnum):
     DONE = 3
     STOPPED = 4
     ERROR = 5
+    # Finished every file it could, some failed
+    DONE_WITH_ERRORS = 6
+
+
+THREADS_PER_JOB = 4
+
+# What happens after a file fails: end the batch, go on with the next
+# file, or try the file again a few times before going on
+FAILURE_POLICIES = ["stop", "skip", "retry"]
+# Seconds before the first retry, doubling up to the maximum
+RETRY_BACKOFF = 10
+RETRY_BACKOFF_MAX = 300
+
+SETTINGS_SCHEMA = "net.jeena.recoder.preferences"
+
+# What every output is converted to; streams already in this shape are copied
+TARGET_WIDTH, TARGET_HEIGHT = 1920, 1080
+TARGET_VIDEO_CODEC = "dnxhd"
+TARGET_PIX_FMT = "yuv422p"
+TARGET_VIDEO_BITRATE = 120_000_000
+TARGET_AUDIO_CODEC = "pcm_s16le"
+# DNxHD bitrates come in fixed steps, anything this close is the same profile
+BITRATE_TOLERANCE = 0.15
+
+# GSettings keys and the Transcoder properties they are bound to
+SETTINGS_KEYS = [
+    ("output-folder-template", "output_folder_template"),
+    ("parallel-jobs", "parallel_jobs"),
+    ("incremental", "incremental"),
+    ("split-long-files", "split_long_files"),
+    ("deduplicate", "deduplicate"),
+    ("staging-directory", "staging_directory"),
+    ("extra-outputs", "extra_outputs"),
+    ("queue-order", "queue_order"),
+    ("failure-policy", "failure_policy"),
+    ("retry-count", "retry_count"),
+    ("background-priority", "background_priority"),
+    ("cpu-affinity", "cpu_affinity"),
+]
+
+
+# Sort keys for the waiting files; files whose duration isn't probed yet
+# go after the known ones
+QUEUE_ORDERS = {
+    "list": None,
+    "shortest-first": lambda item: (not item.duration, item.duration),
+    "longest-first": lambda item: (not item.duration, -item.duration),
+}
+
+
+def default_job_count():
+    return max(1, available_cores() // THREADS_PER_JOB)
 
 
 class Transcoder(GObject.GObject):
-    TIME_RE = re.compile(r"time=(\d+):(\d+):(\d+)\.(\d+)")
-
     batch_progress = GObject.Property(type=int, minimum=0, maximum=100, default=0)
     batch_status = GObject.Property(type=BatchStatus, default=BatchStatus.IDLE)
 
+    # Totals over the files encoding right now, eta for the whole batch
+    fps = GObject.Property(type=float, default=0.0)
+    speed = GObject.Property(type=float, default=0.0)
+    bitrate = GObject.Property(type=float, default=0.0)
+    bytes_written = GObject.Property(type=GObject.TYPE_UINT64, default=0)
+    eta = GObject.Property(type=float, default=0.0)
+
     # Property bound to GSettings key for output folder template
     output_folder_template = GObject.Property(type=str, default="transcoded")
 
-    def __init__(self, file_items):
+    # Number of files transcoded at once, 0 means one job per THREADS_PER_JOB cores
+    parallel_jobs = GObject.Property(type=int, minimum=0, maximum=64, default=0)
+
+    # Skip sources whose output in the manifest is still up to date
+    incremental = GObject.Property(type=bool, default=False)
+
+    # Cut long files at keyframes and encode the pieces in parallel
+    split_long_files = GObject.Property(type=bool, default=False)
+
+    # Encode identical sources once and link the other copies to the output
+    deduplicate = GObject.Property(type=bool, default=True)
+
+    # Fast local directory ffmpeg writes to before outputs are moved, "" for none
+    staging_directory = GObject.Property(type=str, default="")
+
+    # Names of profiles.PROFILES made from the same decode as the master
+    extra_outputs = GObject.Property(type=GObject.TYPE_STRV)
+
+    # One of QUEUE_ORDERS, can be changed while the batch runs
+    queue_order = GObject.Property(type=str, default="list")
+
+    # One of FAILURE_POLICIES, and the attempts after the first for "retry"
+    failure_policy = GObject.Property(type=str, default="stop")
+    retry_count = GObject.Property(type=int, minimum=1, maximum=10, default=2)
+
+    # Run ffmpeg at the lowest CPU and idle I/O priority, optionally on the
+    # CPUs in cpu_affinity ("0-3,6", "" for all); switches running jobs too
+    background_priority = GObject.Property(type=bool, default=False)
+    cpu_affinity = GObject.Property(type=str, default="")
+
+    def __init__(self, file_items, journal=None, bind_settings=True):
         super().__init__()
-        self.file_items = file_items
+        self.file_items = list(file_items)
+        self.journal = journal
         self.is_processing = False
         self._stop_requested = False
+        self._keep_journal = False
+        self._failed = False
+        self._error_count = 0
+        self._attempts = {}
         self._paused = threading.Event()
         self._paused.set()
-        self._process = None
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._progress = {}
+        self._manifests = {}
+        self._budget = ThreadBudget()
+        self._remaining = 0
+        self._jobs = JobQueue(job_devices=self._job_devices)
+        self._duplicates = DuplicateIndex()
+        self._mover = OutputMover()
+        self._space = SpaceReservations()
+        self._space_tokens = {}
+        self._extra_segments = 0
+        self._ui = PropertyCoalescer()
+        self.metrics_log = MetricsLog()
+        self._metrics = {}
+        self._bytes_done = 0
+        self._batch_speed = 0.0
+
+        self.connect("notify::queue-order", self.on_queue_order_changed)
+        self.connect("notify::background-priority", self.on_priority_changed)
+        self.connect("notify::cpu-affinity", self.on_priority_changed)
+        if bind_settings:
+            self.settings = Gio.Settings.new(SETTINGS_SCHEMA)
+            for key, prop in SETTINGS_KEYS:
+                self.settings.bind(key, self, prop, Gio.SettingsBindFlags.DEFAULT)
+
+    def on_queue_order_changed(self, *args):
+        self._jobs.set_order(QUEUE_ORDERS.get(self.queue_order))
+
+    def on_priority_changed(self, *args):
+        with self._lock:
+            for process in self._processes:
+                if process.poll() is None:
+                    self._apply_priority(process)
+
+    def _apply_priority(self, process):
+        try:
+            cpus = priority.parse_cpu_list(self.cpu_affinity)
+        except ValueError:
+            cpus = None
+        priority.apply(process.pid, self.background_priority, cpus)
 
-        self.settings = Gio.Settings.new("net.jeena.recoder.preferences")
-        self.settings.bind(
-            "output-folder-template", self,
-            "output_folder_template",
-            Gio.SettingsBindFlags.DEFAULT
-        )
+    def move_to_front(self, file_item):
+        # Transcode a waiting file next, without stopping the batch
+        file_item.pinned = True
+        self._jobs.prioritize(file_item)
 
     def get_output_folder(self, path):
         source_folder = os.path.basename(os.path.dirname(path))
@@ -51,155 +194,654 @@ class Transcoder(GObject.GObject):
         output_folder = os.path.join(os.path.dirname(path), folder_name)
         return output_folder
 
+    def get_output_path(self, path):
+        return self._get_output_path(self.get_output_folder(path), os.path.basename(path))
+
+    def get_job_count(self):
+        return self.parallel_jobs or default_job_count()
+
     def start(self):
         if self.is_processing:
             return
         self.is_processing = True
         self._stop_requested = False
+        self._keep_journal = False
+        self._failed = False
+        self._error_count = 0
+        self._attempts = {}
         self._paused.set()
+
+        self._progress = {}
+        self._metrics = {}
+        self._bytes_done = 0
+        self._batch_speed = 0.0
+        pending = []
+        for file_item in self.file_items:
+            # Files finished before an interrupted batch was resumed
+            if file_item.status == FileStatus.DONE:
+                self._progress[file_item] = 1.0
+            else:
+                pending.append(file_item)
+        self._remaining = len(pending)
+        self._track(pending)
+        if self.journal:
+            self.journal.begin(self.file_items)
+        self._jobs.put(pending)
+        # Files moved to the front before the batch started, first one first
+        for file_item in reversed(pending):
+            if file_item.pinned:
+                self._jobs.prioritize(file_item)
+
         self.batch_status = BatchStatus.RUNNING
         threading.Thread(target=self._process_files, daemon=True).start()
 
     def pause(self):
         self._paused.clear()
         self.batch_status = BatchStatus.PAUSED
-        if self._process and self._process.poll() is None:
-            self._process.send_signal(signal.SIGSTOP)
+        self._signal_processes(signal.SIGSTOP)
 
     def resume(self):
         self._paused.set()
         self.batch_status = BatchStatus.RUNNING
-        if self._process and self._process.poll() is None:
-            self._process.send_signal(signal.SIGCONT)
-
-    def stop(self):
+        self._signal_processes(signal.SIGCONT)
+
+    def add_files(self, file_items):
+        # False if the batch is already finishing and can't take them
+        file_items = list(file_items)
+        if not self.is_processing:
+            with self._lock:
+                self.file_items.extend(file_items)
+            return True
+
+        with self._lock:
+            self.file_items.extend(file_items)
+            self._remaining += len(file_items)
+        self._track(file_items)
+        if self.journal:
+            self.journal.add(file_items)
+        if not self._jobs.put(file_items):
+            with self._lock:
+                for file_item in file_items:
+                    self.file_items.remove(file_item)
+                    self._metrics.pop(file_item, None)
+                self._remaining -= len(file_items)
+            return False
+        self._update_progress()
+        return True
+
+    def set_input_open(self, is_open):
+        # Keep workers waiting for files that are still being scanned
+        self._jobs.set_open(is_open)
+
+    def stop(self, keep_journal=False):
         self._stop_requested = True
+        self._keep_journal = keep_journal
+        self._jobs.cancel()
         self._paused.set()
-        if self._process and self._process.poll() is None:
-            self._process.terminate()
+        with self._lock:
+            for process in self._processes:
+                if process.poll() is None:
+                    # A stopped process can't handle SIGTERM until it continues
+                    process.send_signal(signal.SIGCONT)
+                    process.terminate()
         self.batch_status = BatchStatus.STOPPED
 
+    def _signal_processes(self, sig):
+        with self._lock:
+            for process in self._processes:
+                if process.poll() is None:
+                    process.send_signal(sig)
+
     def _process_files(self):
-        total = len(self.file_items)
+        workers = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(self.get_job_count())
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self._mover.drain()
 
-        for idx, file_item in enumerate(self.file_items, start=1):
-            if self._stop_requested:
-                GLib.idle_add(file_item.set_property, "status", FileStatus.WAITING)
-                continue
+        self.is_processing = False
+        with self._lock:
+            manifests = list(self._manifests.values())
+        for manifest in manifests:
+            manifest.save()
+        get_probe_cache().flush()
+        tracing.save()
+
+        if self.journal:
+            if self._keep_journal:
+                self.journal.detach()
+            else:
+                self.journal.close()
+
+        # Goes through the coalescer so it lands after the last file updates
+        if self._stop_requested:
+            self._ui.set(self, "batch_status", BatchStatus.STOPPED)
+        elif self._failed:
+            self._ui.set(self, "batch_status", BatchStatus.ERROR)
+        elif self._error_count:
+            self._ui.set(self, "batch_status", BatchStatus.DONE_WITH_ERRORS)
+        else:
+            self._ui.set(self, "batch_status", BatchStatus.DONE)
+
+        self._ui.set(self, "batch_progress", 0)
+        for name in ("fps", "speed", "bitrate", "eta"):
+            self._ui.set(self, name, 0.0)
+
+    def _worker(self):
+        while True:
+            with tracing.span("wait for job", "queue"):
+                file_item = self._jobs.get()
+            if file_item is None:
+                return
+
+            self._paused.wait()
+            if self._stop_requested or self._failed:
+                return
 
             path = file_item.file.get_path()
             base = os.path.basename(path)
 
-            GLib.idle_add(file_item.set_property, "status", FileStatus.PROCESSING)
-            GLib.idle_add(file_item.set_property, "progress", 0)
+            self._ui.set(file_item, "status", FileStatus.PROCESSING)
+            self._ui.set(file_item, "progress", 0)
+            self._ui.set(file_item, "error", "")
+            with self._lock:
+                metrics = self._metrics.setdefault(file_item, JobMetrics(path, time.monotonic()))
+            metrics.started_at = time.monotonic()
 
             output_folder = self.get_output_folder(path)
-            success, _ = self._transcode_file(path, output_folder, base, idx, total, file_item)
+            try:
+                self._transcode_file(path, output_folder, base, file_item)
+            except Exception as e:
+                # E.g. an output folder that can't be created; the file
+                # fails but the batch and this worker go on
+                self._release_space(file_item)
+                self._duplicates.finish(path, False, None)
+                self._finish_file(file_item, False, str(e))
+            finally:
+                # Moving a staged output doesn't touch the job's devices
+                self._jobs.done(file_item)
+
+    def _track(self, file_items):
+        now = time.monotonic()
+        with self._lock:
+            for file_item in file_items:
+                self._metrics[file_item] = JobMetrics(file_item.file.get_path(), now)
+
+    def _staging_dir(self):
+        return os.path.expanduser(self.staging_directory) if self.staging_directory else None
+
+    def _job_devices(self, file_item):
+        # Where the job reads from and where ffmpeg writes to
+        path = file_item.file.get_path()
+        write_dir = self._staging_dir() or self.get_output_folder(path)
+        return tuple({device for device in (device_of(path), device_of(write_dir)) if device is not None})
+
+    def _release_space(self, file_item):
+        with self._lock:
+            token = self._space_tokens.pop(file_item, None)
+            if token is not None:
+                self._space.release(token)
+                self._jobs.release_held()
+
+    def _finish_file(self, file_item, success, reason=None):
+        if reason:
+            self._ui.set(file_item, "error", reason)
+        for name in ("fps", "eta"):
+            self._ui.set(file_item, name, 0.0)
+
+        retry = not success and not self._stop_requested and self._retry_later(file_item)
+        with self._lock:
+            metrics = self._metrics.pop(file_item, None)
+            if metrics:
+                metrics.encoding = False
+                self._bytes_done += metrics.bytes_written
+        if metrics and not self._stop_requested:
+            status = metrics.outcome or ("done" if success else "error")
+            self.metrics_log.append(metrics.record(status, self.get_output_path(metrics.path), reason))
+        if retry:
+            # Counts as queued again from when it is due
+            with self._lock:
+                next_metrics = JobMetrics(metrics.path if metrics else file_item.file.get_path(), time.monotonic())
+                next_metrics.attempt = self._attempts[file_item] + 1
+                self._metrics[file_item] = next_metrics
+            return
 
-            new_status = FileStatus.DONE if success else FileStatus.ERROR
-            GLib.idle_add(file_item.set_property, "status", new_status)
-            GLib.idle_add(file_item.set_property, "progress", 100 if success else 0)
+        path = file_item.file.get_path()
+        if self.journal and not self._stop_requested:
+            self.journal.finished(path, success)
 
+        new_status = FileStatus.DONE if success else FileStatus.ERROR
+        self._ui.set(file_item, "status", new_status)
+        self._ui.set(file_item, "progress", 100 if success else 0)
+        self._update_progress(file_item, 1.0 if success else 0.0)
+        with self._lock:
+            self._remaining -= 1
             if not success and not self._stop_requested:
-                self.batch_status = BatchStatus.ERROR
-                break
-
-            if self._stop_requested:
-                break
-
-        self.is_processing = False
-
-        if not self._stop_requested and self.batch_status != BatchStatus.ERROR:
-            self.batch_status = BatchStatus.DONE
-        elif self._stop_requested:
-            self.batch_status = BatchStatus.STOPPED
-
-        GLib.idle_add(self.set_property, "batch_progress", 0)
-
-    def _transcode_file(self, input_path, output_dir, basename, idx, total, file_item):
-        os.makedirs(output_dir, exist_ok=True)
+                self._error_count += 1
+
+        if not success and not self._stop_requested and self.failure_policy == "stop":
+            # Let jobs already running finish but don't start new ones
+            self._failed = True
+            self._jobs.cancel()
+
+    def _retry_later(self, file_item):
+        if self.failure_policy != "retry":
+            return False
+        with self._lock:
+            attempt = self._attempts.get(file_item, 0) + 1
+            if attempt > self.retry_count:
+                return False
+            self._attempts[file_item] = attempt
+
+        self._ui.set(file_item, "status", FileStatus.WAITING)
+        self._ui.set(file_item, "progress", 0)
+        self._update_progress(file_item, 0.0)
+        self._jobs.put_later(file_item, min(RETRY_BACKOFF * 2 ** (attempt - 1), RETRY_BACKOFF_MAX))
+        return True
+
+    def _update_progress(self, file_item=None, fraction=0.0):
+        with self._lock:
+            if file_item is not None:
+                self._progress[file_item] = fraction
+            batch_fraction = sum(self._progress.values()) / len(self.file_items)
+
+            encoding = [m for m in self._metrics.values() if m.encoding]
+            speed = sum(m.smoothed_speed for m in encoding)
+            if speed:
+                self._batch_speed = smooth(self._batch_speed, speed)
+            # Media still to encode over how fast it is going, files that
+            # aren't probed yet count as far as their duration is known
+            remaining = sum(
+                max(0.0, (m.media_seconds or item.duration) - m.out_time)
+                for item, m in self._metrics.items()
+            )
+            eta = remaining / self._batch_speed if self._batch_speed else 0.0
+            bytes_written = self._bytes_done + sum(m.bytes_written for m in encoding)
+
+        self._ui.set(self, "batch_progress", int(batch_fraction * 100))
+        self._ui.set(self, "fps", sum(m.fps for m in encoding))
+        self._ui.set(self, "speed", sum(m.speed for m in encoding))
+        self._ui.set(self, "bitrate", sum(m.bitrate for m in encoding))
+        self._ui.set(self, "bytes_written", bytes_written)
+        self._ui.set(self, "eta", eta)
+
+    @tracing.traced("Transcoder._transcode_file", "transcode")
+    def _transcode_file(self, input_path, output_dir, basename, file_item):
+        with tracing.span("makedirs", "io", path=output_dir):
+            os.makedirs(output_dir, exist_ok=True)
         output_path = self._get_output_path(output_dir, basename)
 
-        duration = self._get_duration(input_path) or 1.0
-        width, height, rotate = self._get_video_info(input_path)
-        vf = self._build_filters(width, height, rotate)
-        cmd = self._build_ffmpeg_command(input_path, output_path, vf)
-
-        return self._run_ffmpeg(cmd, duration, idx, total, file_item, output_path)
-
-    def _run_ffmpeg(self, cmd, duration, idx, total, file_item, output_path):
-        self._process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
-
-        while True:
-            self._paused.wait()
-            if self._stop_requested:
-                self._process.terminate()
-                return False, output_path
+        metrics = self._metrics.get(file_item) or JobMetrics(input_path, time.monotonic())
+        started = time.monotonic()
+        with tracing.span("probe_item", "probe"):
+            info = probe_item(file_item)
+        metrics.probe_seconds = time.monotonic() - started
+        metrics.media_seconds = info.duration
+        extras = self._extra_outputs(output_path, info)
+        cmd = self._build_ffmpeg_command(input_path, output_path, info, extra_outputs=extras)
+
+        # Only kept when asked for, nobody else wants the hidden file
+        manifest = self._get_manifest(output_dir) if self.incremental else None
+        fingerprint = probe_fingerprint(info)
+        params = self._encoding_params(cmd, input_path, output_path)
+        if (manifest and manifest.is_up_to_date(input_path, output_path, fingerprint, params)
+                and all(os.path.exists(path) for _, path in extras)):
+            metrics.outcome = "up-to-date"
+            self._finish_file(file_item, True)
+            return
 
-            line = self._process.stderr.readline()
-            if not line:
-                break
+        def finish(success, reason=None):
+            if metrics.encode_started_at:
+                metrics.finalize_seconds = time.monotonic() - metrics.encode_started_at - metrics.encode_seconds
+            if success and manifest:
+                manifest.record(input_path, output_path, fingerprint, params)
+            self._duplicates.finish(input_path, success, output_path)
+            self._release_space(file_item)
+            self._finish_file(file_item, success, reason)
+
+        # ffmpeg never writes to the final name, so an interrupted encode
+        # can't leave a truncated file that looks finished
+        staging_dir = self._staging_dir()
+        if staging_dir:
+            os.makedirs(staging_dir, exist_ok=True)
+        work_path = work_path_for(output_path, staging_dir)
+        work_extras = [(profile, work_path_for(path, staging_dir)) for profile, path in extras]
+        work_cmd = self._build_ffmpeg_command(input_path, work_path, info, extra_outputs=work_extras)
+        segment_bounds = self._plan_segments(input_path, info)
+        # The master goes last, once it is in place the whole set is
+        moves = [
+            (work, final) for (_, work), (_, final) in zip(work_extras, extras)
+        ] + [(work_path, output_path)]
+
+        # Segments and the joined file are on disk together until the end
+        size = estimate_output_size(work_cmd, info) * (2 if segment_bounds else 1)
+        size += sum(int(profile.bitrate * (info.duration or 0) / 8) for profile, _ in extras)
+        with self._lock:
+            token = self._space.try_reserve({output_dir, os.path.dirname(work_path)}, size)
+            if token is None and self._space.active:
+                # Running jobs will free their share when they finish, let
+                # files that fit go first until then
+                self._jobs.hold(file_item)
+                self._ui.set(file_item, "status", FileStatus.WAITING)
+                return
+            if token is not None:
+                self._space_tokens[file_item] = token
+        if token is None:
+            # Doesn't fit even with nothing else running
+            finish(False, "Not enough free disk space for the output")
+            return
 
-            match = self.TIME_RE.search(line)
-            if match:
-                h, m, s, ms = map(int, match.groups())
-                elapsed = h * 3600 + m * 60 + s + ms / 1000.0
-                file_progress = min(elapsed / duration, 1.0)
+        # Only registered once it is sure to run, copies wait for it
+        try:
+            primary = self._duplicates.register(input_path) if self.deduplicate else None
+        except Exception:
+            primary = None
+        if primary is not None and not primary.finished:
+            # Comes back to the front of the queue once the first copy is
+            # done, without keeping a worker waiting meanwhile
+            self._release_space(file_item)
+            self._jobs.park(file_item)
+            self._ui.set(file_item, "status", FileStatus.WAITING)
+            self._duplicates.when_finished(primary, lambda: self._jobs.unpark(file_item))
+            return
+        if primary is not None and self._link_duplicate(primary, output_path, extras):
+            metrics.outcome = "linked"
+            finish(True)
+            return
 
-                file_percent = int(file_progress * 100)
-                batch_fraction = (idx - 1 + file_progress) / total
-                batch_percent = int(batch_fraction * 100)
+        if manifest:
+            manifest.forget(output_path)
+        errors = []
+        metrics.encode_started_at = time.monotonic()
+        try:
+            success = self._encode(
+                input_path, work_path, file_item, info, work_cmd, segment_bounds, token, metrics, errors.append
+            )
+        except Exception as e:
+            success = False
+            errors.append(str(e))
+        metrics.encode_seconds = time.monotonic() - metrics.encode_started_at
+        metrics.encoding = False
+
+        if not success:
+            remove_work_files(moves)
+            finish(False, errors[-1] if errors else None)
+        elif staging_dir:
+            # Copy off the scratch disk in the background and go on with the
+            # next file meanwhile. The workers stay until it is done, so
+            # files added in the meantime are still picked up.
+            def moved(success, reason):
+                try:
+                    if not success:
+                        remove_work_files(moves)
+                    finish(success, reason)
+                finally:
+                    self._jobs.remove_pending()
+
+            self._jobs.add_pending()
+            self._mover.submit(moves, moved)
+        else:
+            reason = None
+            try:
+                with tracing.span("move_into_place", "io"):
+                    for work, final in moves:
+                        move_into_place(work, final)
+            except OSError as e:
+                success, reason = False, f"Couldn't move the output into place: {e}"
+                remove_work_files(moves)
+            finish(success, reason)
+
+    def _extra_outputs(self, output_path, info):
+        return [
+            (profile, extra_output_path(output_path, profile))
+            for profile in get_profiles(self.extra_outputs or [])
+            # Nothing to put in an audio file for a silent clip
+            if profile.height or info.audio_codec
+        ]
 
-                GLib.idle_add(file_item.set_property, "progress", file_percent)
-                GLib.idle_add(self.set_property, "batch_progress", batch_percent)
+    def _link_duplicate(self, primary, output_path, extras):
+        if not primary.success or self._stop_requested:
+            return False
+        try:
+            link_output(primary.output_path, output_path)
+            for profile, path in extras:
+                link_output(extra_output_path(primary.output_path, profile), path)
+        except OSError:
+            return False
+        return True
+
+    @tracing.traced("Transcoder._encode", "transcode")
+    def _encode(self, input_path, output_path, file_item, info, cmd, segment_bounds, space_token, metrics, on_error):
+        # Without a duration there is no percentage or ETA, only the rates
+        duration = info.duration or 0.0
+        if self.journal:
+            self.journal.started(input_path, output_path)
+        metrics.encoding = True
+
+        def report(fraction, fields):
+            metrics.update(fields)
+            metrics.out_time = fraction * duration
+            self._ui.set(file_item, "progress", int(fraction * 100))
+            self._ui.set(file_item, "speed", metrics.speed)
+            self._ui.set(file_item, "fps", metrics.fps)
+            self._ui.set(file_item, "bitrate", metrics.bitrate)
+            self._ui.set(file_item, "bytes_written", metrics.bytes_written)
+            self._ui.set(file_item, "eta", metrics.eta)
+            self._space.update(space_token, fields.get("total_size"))
+            self._update_progress(file_item, fraction)
+
+        if segment_bounds:
+            return self._transcode_segments(
+                input_path, output_path, info, duration, segment_bounds, report, on_error
+            )
+        return self._run_ffmpeg(cmd, duration, report, on_error)
+
+    def _plan_segments(self, input_path, info):
+        if not self.split_long_files or not info.duration:
+            return []
+        # A stream copy is already as fast as reading the file
+        if self._copies_video(info):
+            return []
+        # Extra outputs come from the one decode of the whole file
+        if self.extra_outputs:
+            return []
+        if info.duration < segments.SPLIT_MIN_DURATION:
+            return []
+        targets = segments.cut_targets(info.duration, self.get_job_count())
+        if not targets:
+            return []
+        keyframes = segments.probe_keyframes(input_path, targets)
+        return segments.plan_segments(keyframes, info.duration, self.get_job_count())
+
+    def _transcode_segments(self, input_path, output_path, info, duration, segment_bounds, report, on_error):
+        seg_dir = segments.segment_dir(output_path)
+        os.makedirs(seg_dir, exist_ok=True)
+        done_seconds = [0.0] * len(segment_bounds)
+        sizes = [0] * len(segment_bounds)
+        # Latest fields of the segments that are still encoding
+        running = {}
+        progress_lock = threading.Lock()
+
+        def encode(index, start, end):
+            length = end - start
+            seg_path = os.path.join(seg_dir, f"{index:04d}.mov")
+            input_args = ["-ss", f"{start:.6f}", "-t", f"{length:.6f}"]
+            cmd = self._build_ffmpeg_command(input_path, seg_path, info, input_args)
+
+            def seg_report(fraction, fields):
+                with progress_lock:
+                    done_seconds[index] = fraction * length
+                    running[index] = fields
+                    if fields.get("total_size") is not None:
+                        sizes[index] = fields["total_size"]
+                    combined = combine_progress(list(running.values()), sum(sizes))
+                    report(min(sum(done_seconds) / duration, 1.0), combined)
+
+            try:
+                success = self._run_ffmpeg(cmd, length, seg_report, on_error)
+            finally:
+                with progress_lock:
+                    running.pop(index, None)
+            return seg_path if success else None
+
+        # The segments of one file share the budget like separate files
+        with self._lock:
+            self._extra_segments += len(segment_bounds) - 1
+        try:
+            with ThreadPoolExecutor(max_workers=len(segment_bounds)) as executor:
+                futures = [
+                    executor.submit(encode, index, start, end)
+                    for index, (start, end) in enumerate(segment_bounds)
+                ]
+                seg_paths = [future.result() for future in futures]
+
+            if None in seg_paths or self._stop_requested:
+                return False
+
+            list_path = os.path.join(seg_dir, "concat.txt")
+            segments.write_concat_list(seg_paths, list_path)
+            concat_cmd = segments.build_concat_command(list_path, input_path, output_path)
+            return self._run_ffmpeg(concat_cmd, duration, lambda fraction, fields: None, on_error)
+        finally:
+            with self._lock:
+                self._extra_segments -= len(segment_bounds) - 1
+            segments.remove_segment_dir(output_path)
+
+    def _get_manifest(self, output_dir):
+        with self._lock:
+            manifest = self._manifests.get(output_dir)
+            if manifest is None:
+                manifest = self._manifests[output_dir] = OutputManifest(output_dir)
+            return manifest
+
+    def _encoding_params(self, cmd, in_path, out_path):
+        # Everything that influences the output file, without the paths
+        return [arg for arg in cmd if arg not in (in_path, out_path, "-y")]
+
+    def _expected_jobs(self):
+        # Jobs likely to share the CPU from now on; fewer once the queue drains
+        with self._lock:
+            remaining = self._remaining + self._extra_segments
+        return max(self._budget.active_jobs + 1, min(self.get_job_count(), remaining))
+
+    @tracing.traced("Transcoder._run_ffmpeg", "ffmpeg")
+    def _run_ffmpeg(self, cmd, duration, on_progress, on_error=None):
+        if self._stop_requested:
+            return False
+        token, threads = self._budget.acquire(self._expected_jobs())
+        try:
+            return self._run_ffmpeg_process(apply_thread_args(cmd, threads), duration, on_progress, on_error)
+        finally:
+            self._budget.release(token)
+
+    def _run_ffmpeg_process(self, cmd, duration, on_progress, on_error=None):
+        with tracing.span("spawn ffmpeg", "ffmpeg", output=cmd[-1]):
+            process = subprocess.Popen(
+                with_progress_args(cmd),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace"
+            )
+        stderr = StderrTail(process.stderr)
+        with self._lock:
+            # Under the lock, so a switch of the mode can't slip in between
+            if self.background_priority:
+                self._apply_priority(process)
+            self._processes.add(process)
+        # pause() may have run between spawning and registering the process
+        if not self._paused.is_set():
+            process.send_signal(signal.SIGSTOP)
 
-        self._process.wait()
-        return self._process.returncode == 0, output_path
+        try:
+            for fields in read_progress(process.stdout):
+                self._paused.wait()
+                if self._stop_requested:
+                    process.terminate()
+                    process.wait()
+                    return False
+
+                if fields["out_time"] is not None:
+                    fraction = max(0.0, min(fields["out_time"] / duration, 1.0)) if duration else 0.0
+                    on_progress(fraction, fields)
+
+            process.wait()
+            if process.returncode != 0 and not self._stop_requested and on_error:
+                on_error(stderr.text() or f"ffmpeg exited with status {process.returncode}")
+            return process.returncode == 0 and not self._stop_requested
+        finally:
+            with self._lock:
+                self._processes.discard(process)
 
     def _get_output_path(self, out_dir, basename):
         name, _ = os.path.splitext(basename)
         return os.path.join(out_dir, f"{name}.mov")
 
-    def _get_duration(self, path):
-        try:
-            out = subprocess.check_output([
-                "ffprobe", "-v", "error", "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1", path
-            ], text=True)
-            return float(out.strip())
-        except Exception:
-            return None
-
-    def _get_video_info(self, path):
-        try:
-            out = subprocess.check_output([
-                "ffprobe", "-v", "error", "-select_streams", "v:0",
-                "-show_entries", "stream=width,height:stream_tags=rotate",
-                "-of", "default=noprint_wrappers=1:nokey=1", path
-            ], text=True).splitlines()
-            width = int(out[0])
-            height = int(out[1])
-            rotate = int(out[2]) if len(out) > 2 else 0
-            return width, height, rotate
-        except Exception:
-            return None, None, 0
-
     def _build_filters(self, width, height, rotate):
         filters = []
         if rotate in [90, 270] or (width and height and height > width):
             filters.append("transpose=1")
             width, height = height, width
-        if (width, height) != (1920, 1080):
-            filters.append("scale=1920:1080")
+        if (width, height) != (TARGET_WIDTH, TARGET_HEIGHT):
+            filters.append(f"scale={TARGET_WIDTH}:{TARGET_HEIGHT}")
         return ",".join(filters) if filters else None
 
-    def _build_ffmpeg_command(self, in_path, out_path, vf):
-        cmd = [
-            "ffmpeg", "-y", "-i", in_path,
-            "-vcodec", "dnxhd", "-acodec", "pcm_s16le",
-            "-b:v", "120M", "-pix_fmt", "yuv422p",
-            "-f", "mov", "-map_metadata", "0"
+    def _copies_video(self, info):
+        if self._build_filters(info.width, info.height, info.rotate):
+            return False
+        if info.video_codec != TARGET_VIDEO_CODEC or info.pix_fmt != TARGET_PIX_FMT:
+            return False
+        if not info.video_bitrate:
+            return False
+        return abs(info.video_bitrate / TARGET_VIDEO_BITRATE - 1) <= BITRATE_TOLERANCE
+
+    def _copies_audio(self, info):
+        return info.audio_codec == TARGET_AUDIO_CODEC
+
+    def _build_ffmpeg_command(self, in_path, out_path, info, input_args=None, extra_outputs=()):
+        # Streams that already match the target are copied, so material
+        # that was converted before is only remuxed
+        copy_video = self._copies_video(info)
+        copy_audio = self._copies_audio(info)
+        vf = None if copy_video else self._build_filters(info.width, info.height, info.rotate)
+
+        cmd = ["ffmpeg", "-y"] + (input_args or []) + ["-i", in_path]
+
+        # Extra outputs go first so the master stays the last output, which
+        # is where the thread options and the output path are expected
+        video_extras = [profile for profile, _ in extra_outputs if profile.height]
+        if video_extras:
+            # Decode, rotate and scale once and split the frames between
+            # the master and the proxies
+            labels = ([] if copy_video else ["master"]) + [f"v{n}" for n in range(len(video_extras))]
+            split = f"split={len(labels)}" + "".join(f"[{label}]" for label in labels)
+            graph = ["[0:v:0]" + (f"{vf}," if vf else "") + split]
+            graph += [
+                f"[v{n}]scale=-2:{profile.height}[proxy{n}]"
+                for n, profile in enumerate(video_extras)
+            ]
+            cmd += ["-filter_complex", ";".join(graph)]
+            vf = None
+
+        proxies = 0
+        for profile, path in extra_outputs:
+            if profile.height:
+                cmd += ["-map", f"[proxy{proxies}]", "-map", "0:a:0?"]
+                proxies += 1
+            else:
+                cmd += ["-map", "0:a:0"]
+            cmd += list(profile.args) + ["-map_metadata", "0", path]
+
+        if video_extras:
+            cmd += ["-map", "0:v:0" if copy_video else "[master]", "-map", "0:a:0?"]
+        cmd += [
+            "-vcodec", "copy" if copy_video else TARGET_VIDEO_CODEC,
+            "-acodec", "copy" if copy_audio else TARGET_AUDIO_CODEC,
         ]
+        if not copy_video:
+            cmd += ["-b:v", f"{TARGET_VIDEO_BITRATE // 1_000_000}M", "-pix_fmt", TARGET_PIX_FMT]
+        cmd += ["-f", "mov", "-map_metadata", "0"]
         if vf:
             cmd += ["-vf", vf]
         cmd.append(out_path)
@@ -1,34 +1,134 @@
+import gi
 import os
+import time
 import shutil
+import threading
 import subprocess
-from typing import Union, List
-from gi.repository import Gio, Notify
+from typing import Callable, Iterator, Optional, Sequence, Union, List
+from gi.repository import Gio
 
 from recoder.models import FileItem
+from recoder import tracing
 
 SUPPORTED_EXTENSIONS = (".mp4", ".mov", ".mkv", ".avi")
 
-def extract_video_files(value: Union[Gio.File, List[Gio.File]]) -> List[FileItem]:
+# A scan hands files to the UI in batches of this size or this often
+SCAN_BATCH_SIZE = 200
+SCAN_BATCH_INTERVAL = 0.1
+
+def _as_file_list(value: Union[Gio.File, List[Gio.File]]) -> List[Gio.File]:
     if isinstance(value, Gio.File):
-        uris = [value]
+        return [value]
     elif isinstance(value, list):
-        uris = value
-    else:
-        return []
+        return value
+    return []
+
+def iter_video_files(
+    value: Union[Gio.File, List[Gio.File]],
+    max_depth: Optional[int] = 0,
+    extensions: Sequence[str] = SUPPORTED_EXTENSIONS,
+    cancel: Optional[threading.Event] = None,
+) -> Iterator[str]:
+    # max_depth 0 only looks at the dropped folder itself, None has no limit
+    extensions = tuple(ext.lower() for ext in extensions)
+
+    def walk(path, depth):
+        try:
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            return
+        subdirs = []
+        for entry in entries:
+            if cancel and cancel.is_set():
+                return
+            try:
+                if entry.is_file() and entry.name.lower().endswith(extensions):
+                    yield entry.path
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+            except OSError:
+                continue
+        if max_depth is None or depth < max_depth:
+            for subdir in subdirs:
+                yield from walk(subdir, depth + 1)
 
-    files = []
-    for file in uris:
+    for file in _as_file_list(value):
+        if cancel and cancel.is_set():
+            return
         path = file.get_path()
-        if os.path.isdir(path):
-            for entry in os.scandir(path):
-                if entry.is_file() and entry.name.lower().endswith(SUPPORTED_EXTENSIONS):
-                    files.append(FileItem(Gio.File.new_for_path(entry.path)))
-        elif os.path.isfile(path) and path.lower().endswith(SUPPORTED_EXTENSIONS):
-            files.append(FileItem(file))
+        if path and os.path.isdir(path):
+            yield from walk(path, 0)
+        elif path and os.path.isfile(path) and path.lower().endswith(extensions):
+            yield path
+
+class FolderScanner:
+    # Walks the dropped paths on a background thread and hands the found
+    # files to on_batch on the main loop as they turn up
+    def __init__(
+        self,
+        value: Union[Gio.File, List[Gio.File]],
+        on_batch: Callable[[List[FileItem]], None],
+        on_done: Callable[[bool], None],
+        max_depth: Optional[int] = 0,
+        extensions: Sequence[str] = SUPPORTED_EXTENSIONS,
+    ):
+        self.value = value
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self.max_depth = max_depth
+        self.extensions = extensions
+        self._cancel = threading.Event()
+        self.is_running = False
+
+    def start(self):
+        self.is_running = True
+        threading.Thread(target=self._scan, daemon=True).start()
+
+    def cancel(self):
+        self._cancel.set()
 
-    return files
+    @tracing.traced("FolderScanner.scan", "scan")
+    def _scan(self):
+        batch = []
+        last_flush = time.monotonic()
+        for path in iter_video_files(self.value, self.max_depth, self.extensions, self._cancel):
+            batch.append(FileItem(Gio.File.new_for_path(path)))
+            now = time.monotonic()
+            if len(batch) >= SCAN_BATCH_SIZE or now - last_flush >= SCAN_BATCH_INTERVAL:
+                tracing.idle_add(self._deliver, batch)
+                batch = []
+                last_flush = now
+        if batch:
+            tracing.idle_add(self._deliver, batch)
+        tracing.idle_add(self._finish)
+
+    def _deliver(self, batch):
+        if not self._cancel.is_set():
+            self.on_batch(batch)
+        return False
+
+    def _finish(self):
+        self.is_running = False
+        self.on_done(self._cancel.is_set())
+        return False
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
 
 def notify_done(title, body):
+    # Imported and initialised here so neither startup nor the headless CLI
+    # pay for libnotify
+    gi.require_version("Notify", "0.7")
+    from gi.repository import Notify
+
+    if not Notify.is_initted():
+        from recoder.app import APP_NAME
+        Notify.init(APP_NAME)
+
     notification = Notify.Notification.new(title, body, "net.jeena.Recoder")
     notification.show()
 
@@ -1,21 +1,21 @@
 import gi
-import signal
-from enum import Enum, auto
-from functools import partial
+import os
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
-gi.require_version('Notify', '0.7')
 
-from gi.repository import Gtk, Gdk, Gio, Adw, GLib, Notify
+from gi.repository import Gtk, Gdk, Gio, Adw, GLib
 
-from recoder.transcoder import Transcoder, BatchStatus
-from recoder.utils import extract_video_files, notify_done, play_complete_sound
+# The transcoder, journal and libnotify are imported on first use so they
+# don't delay the first frame
+from recoder.utils import FolderScanner, format_duration, notify_done, play_complete_sound
+from recoder.probe import probe_in_background
+from recoder.models import FileItem, FileStatus
 from recoder.file_entry_row import FileEntryRow
 from recoder.drop_handler import DropHandler
 from recoder.app_state import AppState, AppStateManager, UIStateManager
-from recoder.preferences import RecoderPreferences
 from recoder.app import APP_NAME
+from recoder import tracing
 
 
 @Gtk.Template(resource_path="/net/jeena/recoder/window.ui")
@@ -25,10 +25,11 @@ class RecoderWindow(Adw.ApplicationWindow):
     toast_overlay = Gtk.Template.Child()
     overlay = Gtk.Template.Child()
     drop_hint = Gtk.Template.Child()
-    listbox = Gtk.Template.Child()
+    listview = Gtk.Template.Child()
     scrolled_window = Gtk.Template.Child()
     btn_transcode = Gtk.Template.Child()
     btn_clear = Gtk.Template.Child()
+    btn_background = Gtk.Template.Child()
     progress_bar = Gtk.Template.Child()
     folder_label = Gtk.Template.Child()
 
@@ -36,6 +37,7 @@ class RecoderWindow(Adw.ApplicationWindow):
         super().__init__(application=application)
 
         self.state_settings = Gio.Settings.new("net.jeena.recoder.state")
+        self.settings = Gio.Settings.new("net.jeena.recoder.preferences")
 
         # Bind window size and state to your window properties
         self.state_settings.bind("width", self, "default-width", Gio.SettingsBindFlags.DEFAULT)
@@ -50,15 +52,31 @@ class RecoderWindow(Adw.ApplicationWindow):
         self.file_items_to_process = []
         self.current_folder_name = None
         self.transcoder = None
-        self.file_rows = {}
+        self.scanners = []
+        # Files the running scans added to the list, for the toast
+        self.scanned_count = 0
+        self.known_paths = set()
+        # Added while a batch was finishing, transcoded right after it
+        self.late_file_items = []
         self.is_paused = False
 
+        self.file_store = Gio.ListStore(item_type=FileItem)
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.on_row_setup)
+        factory.connect("bind", self.on_row_bind)
+        factory.connect("unbind", self.on_row_unbind)
+        self.listview.set_model(Gtk.NoSelection(model=self.file_store))
+        self.listview.set_factory(factory)
+
         self.app_state_manager = AppStateManager()
         self.drop_handler = DropHandler(self, self.app_state_manager)
         self.ui_manager = UIStateManager(self, self.app_state_manager)
 
         self.btn_transcode.connect("clicked", self.on_transcode_clicked)
         self.btn_clear.connect("clicked", self.on_clear_clicked)
+        # The running transcoder follows the setting, so this switches live
+        self.settings.bind("background-priority", self.btn_background, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.connect("close-request", self.on_close_request)
 
         self.app_state_manager.state = AppState.IDLE
 
@@ -70,8 +88,12 @@ class RecoderWindow(Adw.ApplicationWindow):
             Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION,
         )
 
-        Notify.init(APP_NAME)
+        # Hidden preference, RECODER_TRACE does the same from the environment
+        trace_file = self.settings.get_string("trace-file")
+        if trace_file:
+            tracing.enable(trace_file)
 
+        tracing.idle_add(self.offer_resume)
 
     def process_drop_value(self, value):
         folder_file = None
@@ -83,32 +105,152 @@ class RecoderWindow(Adw.ApplicationWindow):
         if folder_file:
             self.current_folder_name = folder_file.get_basename()
 
-        file_items = extract_video_files(value)
+        self.cancel_scans()
+        self.clear_listbox()
+        self.file_items_to_process = []
+        self.start_scan(value)
+        return False
+
+    def add_drop_value(self, value):
+        # Dropped while files are loaded or a batch runs: add to the list
+        # and the running queue instead of starting over
+        if self.transcoder and self.transcoder.is_processing:
+            self.transcoder.set_input_open(True)
+        self.start_scan(value)
+        return False
+
+    def start_scan(self, value):
+        if not self.is_scanning():
+            self.scanned_count = 0
+        scanner = FolderScanner(
+            value, self.on_scan_batch, self.on_scan_done,
+            max_depth=self.get_scan_depth(),
+            extensions=self.settings.get_strv("video-extensions"),
+        )
+        self.scanners.append(scanner)
+        scanner.start()
+
+    def cancel_scans(self):
+        for scanner in self.scanners:
+            scanner.cancel()
+        self.scanners = []
+
+    def is_scanning(self):
+        return any(scanner.is_running for scanner in self.scanners)
+
+    def get_scan_depth(self):
+        if not self.settings.get_boolean("recursive-scan"):
+            return 0
+        return self.settings.get_int("scan-max-depth") or None
+
+    def on_scan_batch(self, file_items):
+        self.scanned_count += self.append_file_items(file_items)
+
+    def on_scan_done(self, cancelled):
+        self.scanners = [scanner for scanner in self.scanners if scanner.is_running]
+        if self.transcoder and not self.scanners:
+            self.transcoder.set_input_open(False)
+        if cancelled or self.scanners:
+            return
+
+        if not self.file_items_to_process:
+            self.app_state_manager.state = AppState.IDLE
+            return
+
+        # Only what these scans found that wasn't listed already
+        count = self.scanned_count
+        if not count:
+            return
+        toast = Adw.Toast.new(f"{count} video file{'s' if count != 1 else ''} added")
+        self.toast_overlay.add_toast(toast)
+
+    def append_file_items(self, file_items):
+        # The same file dropped twice is only listed and transcoded once;
+        # returns how many were new
+        file_items = [item for item in file_items if item.file.get_path() not in self.known_paths]
         if not file_items:
-            return False
+            return 0
+        self.known_paths.update(item.file.get_path() for item in file_items)
+        probe_in_background(file_items)
+
+        self.file_store.splice(self.file_store.get_n_items(), 0, file_items)
+        self.file_items_to_process.extend(file_items)
 
+        if self.transcoder and self.transcoder.is_processing:
+            if not self.transcoder.add_files(file_items):
+                self.late_file_items.extend(file_items)
+        elif self.app_state_manager.state != AppState.FILES_LOADED:
+            self.app_state_manager.state = AppState.FILES_LOADED
+        return len(file_items)
+
+    def load_file_items(self, file_items):
         self.clear_listbox()
-        self.file_rows.clear()
+        self.file_items_to_process = []
+        self.append_file_items(file_items)
 
-        for file_item in file_items:
-            row = FileEntryRow(file_item)
-            self.listbox.append(row)
-            self.file_rows[file_item.file] = row
+    def offer_resume(self):
+        from recoder.journal import BatchJournal
 
-        self.file_items_to_process = file_items
-        self.app_state_manager.state = AppState.FILES_LOADED
+        journal_state = BatchJournal.load()
+        if not journal_state:
+            return False
 
-        count = len(self.file_items_to_process)
-        toast = Adw.Toast.new(f"{count} video file{'s' if count != 1 else ''} added")
+        count = len(journal_state.pending)
+        toast = Adw.Toast.new(f"Interrupted batch with {count} file{'s' if count != 1 else ''} left")
+        toast.set_button_label("Resume")
+        toast.set_timeout(0)
+        toast.connect("button-clicked", lambda *_: self.resume_journal(journal_state))
         self.toast_overlay.add_toast(toast)
         return False
 
+    def resume_journal(self, journal_state):
+        from recoder.journal import BatchJournal
+
+        if self.app_state_manager.state not in {AppState.IDLE, AppState.STOPPED}:
+            return
+
+        BatchJournal.discard_partial_outputs(journal_state)
+
+        file_items = []
+        for path in journal_state.files:
+            if not os.path.isfile(path):
+                continue
+            file_item = FileItem(Gio.File.new_for_path(path))
+            if path in journal_state.done:
+                file_item.status = FileStatus.DONE
+                file_item.progress = 100
+            file_items.append(file_item)
+
+        if not file_items:
+            return
+
+        self.current_folder_name = os.path.basename(os.path.dirname(file_items[0].file.get_path()))
+        if self.drop_hint.get_parent():
+            self.overlay.remove_overlay(self.drop_hint)
+        self.load_file_items(file_items)
+        self.start_transcoding()
+
+    def on_row_setup(self, factory, list_item):
+        list_item.set_activatable(False)
+        list_item.set_child(FileEntryRow(on_move_to_front=self.move_to_front))
+
+    def on_row_bind(self, factory, list_item):
+        list_item.get_child().bind(list_item.get_item())
+
+    def on_row_unbind(self, factory, list_item):
+        list_item.get_child().unbind()
+
+    def move_to_front(self, file_item):
+        if self.transcoder and self.transcoder.is_processing:
+            self.transcoder.move_to_front(file_item)
+        else:
+            # Picked up when the batch starts
+            file_item.pinned = True
+
     def clear_listbox(self):
-        child = self.listbox.get_first_child()
-        while child:
-            next_child = child.get_next_sibling()
-            self.listbox.remove(child)
-            child = next_child
+        self.file_store.remove_all()
+        self.known_paths = set()
+        self.late_file_items = []
 
     def on_transcode_clicked(self, button):
         if self.transcoder and self.transcoder.is_processing:
@@ -119,13 +261,21 @@ class RecoderWindow(Adw.ApplicationWindow):
         else:
             self.start_transcoding()
 
-    def start_transcoding(self):
-        if not self.file_items_to_process:
+    def start_transcoding(self, file_items=None):
+        file_items = file_items or self.file_items_to_process
+        self.late_file_items = []
+        if not file_items:
             return
 
-        self.transcoder = Transcoder(self.file_items_to_process)
+        from recoder.transcoder import Transcoder
+        from recoder.journal import BatchJournal
+
+        self.transcoder = Transcoder(file_items, BatchJournal())
         self.transcoder.connect("notify::batch-progress", self.on_transcoder_progress)
+        self.transcoder.connect("notify::eta", self.on_transcoder_progress)
         self.transcoder.connect("notify::batch-status", self.on_transcoder_status)
+        # Start on what was found so far and pick up the rest as it comes
+        self.transcoder.set_input_open(self.is_scanning())
         self.transcoder.start()
         self.app_state_manager.state = AppState.TRANSCODING
         self.toast_overlay.add_toast(Adw.Toast.new("Starting transcoding"))
@@ -145,6 +295,7 @@ class RecoderWindow(Adw.ApplicationWindow):
             self.toast_overlay.add_toast(Adw.Toast.new("Resuming transcoding"))
 
     def on_clear_clicked(self, button):
+        self.cancel_scans()
         if self.transcoder and self.transcoder.is_processing:
             self.transcoder.stop()
         self.transcoder = None
@@ -152,16 +303,49 @@ class RecoderWindow(Adw.ApplicationWindow):
         self.app_state_manager.state = AppState.STOPPED
         self.toast_overlay.add_toast(Adw.Toast.new("File list cleared"))
 
+    def on_close_request(self, window):
+        # Keep the journal so the batch is offered for resume on next launch
+        if self.transcoder and self.transcoder.is_processing:
+            self.transcoder.stop(keep_journal=True)
+        return False
+
     def on_transcoder_progress(self, transcoder, param):
         self.progress_bar.set_fraction(transcoder.batch_progress / 100.0)
+        parts = [f"{transcoder.batch_progress}%"]
+        if transcoder.speed:
+            parts.append(f"{transcoder.speed:.1f}×")
+        if transcoder.eta:
+            parts.append(f"{format_duration(transcoder.eta)} left")
+        self.progress_bar.set_text(" · ".join(parts))
+        self.progress_bar.set_show_text(transcoder.is_processing)
 
     def on_transcoder_status(self, transcoder, param):
+        # Late updates from a batch that was already cleared
+        if transcoder is not self.transcoder:
+            return
+
+        from recoder.transcoder import BatchStatus
+
+        finished = (BatchStatus.DONE, BatchStatus.DONE_WITH_ERRORS)
+        if transcoder.batch_status in finished and self.late_file_items:
+            # Files dropped after the last worker was gone
+            self.start_transcoding(self.late_file_items)
+            return
+
         if transcoder.batch_status == BatchStatus.DONE:
             play_complete_sound()
             notify_done(APP_NAME, "Transcoding finished!")
             self.toast_overlay.add_toast(Adw.Toast.new("Transcoding finished!"))
             self.app_state_manager.state = AppState.DONE
 
+        elif transcoder.batch_status == BatchStatus.DONE_WITH_ERRORS:
+            failed = sum(1 for item in transcoder.file_items if item.status == FileStatus.ERROR)
+            message = f"Transcoding finished, {failed} file{'s' if failed != 1 else ''} failed"
+            play_complete_sound()
+            notify_done(APP_NAME, message)
+            self.toast_overlay.add_toast(Adw.Toast.new(message))
+            self.app_state_manager.state = AppState.DONE
+
         elif transcoder.batch_status == BatchStatus.STOPPED:
             self.app_state_manager.state = AppState.STOPPED
 